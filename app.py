@@ -1,64 +1,488 @@
-from flask import Flask, request, jsonify, render_template_string, send_file
-import speech_recognition as sr
-import sqlite3
+import click
+from flask import (Flask, Request, Response, current_app, request, jsonify, render_template_string, send_file,
+                   stream_with_context)
 from flask_cors import CORS
-import io
+from werkzeug.exceptions import RequestEntityTooLarge
 import datetime
-from googletrans import Translator, LANGUAGES
+import functools
+import hashlib
+import html
+import json
+import os
+import base64
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+import db
+from audio import AudioTooLongError, UnsupportedAudioError, normalize_audio
+from audio_store import AudioStore
+from compression import Compression
+from events import EventHub, TooManySubscribers, sse_stream
+from export import FORMATS, stream_export
+from importer import Importer, read_manifest, walk_audio_files
+from jobs import JobQueue, QueueFull
+from maintenance import Maintenance
+from metrics import Metrics, stage
+from recognition import (RecognitionCache, engine_key, hash_audio, hash_upload, recognition_options, recognize_audio,
+                         recognize_upload, shift_segments)
+from recognizers import backend_from_config
+from streaming import StreamFinished, StreamManager
+from translation import DIRECTIONS, TranslationCache, normalize_text, translate_batch
+from translators import CircuitOpenError, RateLimitedError, TranslatorPool
+from writer import GroupCommitWriter
+
+# Uploaded files are kept in memory up to UPLOAD_SPOOL_SIZE bytes and spooled
+# to a temporary file beyond that
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_SIZE'], mode='rb+')
 
 app = Flask(__name__)
+app.config.from_object(Config)
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS if needed
 
-DATABASE = 'database.db'
-
-# Initialize the database and create tables if they don't exist
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transcriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transcription TEXT NOT NULL,
-            translated_text TEXT,
-            translation_direction TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+db.init_app(app)
+metrics = Metrics(app)
+compression = Compression(app)
+writer = GroupCommitWriter(app)
+job_queue = JobQueue(app)
+recognizer_backend = backend_from_config(app.config)
+recognition_cache = RecognitionCache(app)
+audio_store = AudioStore(app)
+translation_cache = TranslationCache(app)
+translator_pool = TranslatorPool(app)
+event_hub = EventHub(app.config['EVENT_QUEUE_SIZE'], app.config['SSE_MAX_SUBSCRIBERS'])
+recognition_pool = ThreadPoolExecutor(max_workers=app.config['RECOGNITION_WORKERS'],
+                                      thread_name_prefix='recognize')
+stream_manager = StreamManager(event_hub, recognition_pool, recognizer_backend, app)
+
+# Event hub topic carrying changes to the transcriptions table
+TRANSCRIPTIONS_TOPIC = 'transcriptions'
+
+# Archived rows leave the live table, so clients see them as deleted
+maintenance = Maintenance(app, on_archive=lambda ids, version: publish_changes(
+    'delete', version, [{'id': i} for i in ids]), caches=(recognition_cache, translation_cache))
+
+metrics.registry.gauge('job_queue_depth', 'Transcription jobs queued or running.',
+                       function=lambda: job_queue.depth)
+metrics.registry.gauge('stream_sessions', 'Live transcription sessions in progress.',
+                       function=lambda: len(stream_manager.sessions))
+metrics.registry.gauge('sse_subscribers', 'Connected Server-Sent Events clients.',
+                       function=event_hub.subscriber_count)
+metrics.registry.gauge('translator_circuit_open', 'Whether the translation circuit breaker is open (1) or not (0).',
+                       function=lambda: int(translator_pool.breaker.state == 'open'))
+metrics.registry.counter_function(
+    'cache_hits_total', 'Cache hits, by cache.', labelnames=('cache',),
+    function=lambda: {('recognition',): recognition_cache.stats()['hits'],
+                      ('translation',): translation_cache.stats()['hits']})
+metrics.registry.counter_function(
+    'cache_misses_total', 'Cache misses, by cache.', labelnames=('cache',),
+    function=lambda: {('recognition',): recognition_cache.stats()['misses'],
+                      ('translation',): translation_cache.stats()['misses']})
+metrics.registry.gauge(
+    'cache_hit_ratio', 'Share of cache lookups answered from the cache, by cache.', labelnames=('cache',),
+    function=lambda: {('recognition',): recognition_cache.stats()['hit_ratio'],
+                      ('translation',): translation_cache.stats()['hit_ratio']})
 
 # Route: Home Page
+# The page has no per-request content, so it is rendered once and served from
+# memory with validators: browsers reuse their copy for INDEX_MAX_AGE seconds
+# and then get a 304 while it is still current.
 @app.route('/')
 def index():
-    return render_template_string(html_template)
+    page, etag, rendered_at = rendered_index()
+    response = Response(page, mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = rendered_at
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['INDEX_MAX_AGE']
+    return response.make_conditional(request)
+
+@functools.cache
+def rendered_index():
+    page = render_template_string(html_template)
+    rendered_at = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    return page, hashlib.sha1(page.encode()).hexdigest(), rendered_at
+
+# Tell /events subscribers about a change to the transcriptions table.
+# version is the change log version the write produced (see
+# /transcriptions/changes), so clients can tell when they missed an event.
+def publish_change(event, version, **data):
+    event_hub.publish(TRANSCRIPTIONS_TOPIC, event, {'version': version, **data})
+
+# Publish one event per row written by a multi-row statement. Each row's write
+# logged one change, in order, the last one being version.
+def publish_changes(event, version, payloads):
+    first_version = version - len(payloads) + 1
+    for offset, data in enumerate(payloads):
+        publish_change(event, first_version + offset, **data)
+
+# Save a new transcription (without translation), with the timings of the
+# segments it was recognized in, and return the stored row. With
+# RECOGNITION_DEDUPE on, audio that was already transcribed returns the
+# existing row instead of adding a duplicate. upload_hash names the original
+# upload in the audio store. The insert goes through the group-commit writer
+# and this returns once it is committed.
+def save_transcription(transcription, segments=(), audio_hash=None, upload_hash=None):
+    def write(conn):
+        if audio_hash and app.config['RECOGNITION_DEDUPE']:
+            row = conn.execute(db.SELECT_TRANSCRIPTION_BY_AUDIO_HASH, (audio_hash,)).fetchone()
+            if row is not None:
+                return dict(row), None
+        transcription_id = conn.execute(db.INSERT_TRANSCRIPTION, (transcription, audio_hash, upload_hash)).lastrowid
+        conn.executemany(db.INSERT_SEGMENT, [
+            (transcription_id, segment['index'], segment['start_ms'], segment['end_ms'], segment['text'])
+            for segment in segments
+        ])
+        row = dict(conn.execute(db.SELECT_TRANSCRIPTION, (transcription_id,)).fetchone())
+        return row, conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+
+    row, version = writer.write(write)
+    if version is not None:
+        publish_change('insert', version, transcription=row)
+    return row
+
+# Replace a transcription's text and segments with a new recognition of its
+# stored audio. Returns the updated row, or None if it was deleted meanwhile.
+def update_recognition(transcription_id, transcription, segments, audio_hash):
+    def write(conn):
+        if conn.execute(db.UPDATE_RECOGNITION, (transcription, audio_hash, transcription_id)).rowcount == 0:
+            return None, None
+        conn.execute(db.DELETE_SEGMENTS, (transcription_id,))
+        conn.executemany(db.INSERT_SEGMENT, [
+            (transcription_id, segment['index'], segment['start_ms'], segment['end_ms'], segment['text'])
+            for segment in segments
+        ])
+        row = dict(conn.execute(db.SELECT_TRANSCRIPTION, (transcription_id,)).fetchone())
+        return row, conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+
+    row, version = writer.write(write)
+    if row is not None:
+        publish_change('update', version, transcription=row)
+    return row
+
+# Keep the original upload in the audio store; returns its hash, or None when
+# the store is disabled
+def store_upload(upload, upload_hash):
+    if not audio_store.enabled:
+        return None
+    with stage('store'):
+        audio_store.put(upload, upload_hash)
+    return upload_hash
+
+# A file a queued job can decode the upload from after the request is over:
+# the audio store's copy when there is one, else a temporary copy the job
+# deletes. Returns (path, remove).
+def upload_path(upload, stored_hash):
+    if stored_hash is not None:
+        return audio_store.path(stored_hash), False
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(prefix='upload-', delete=False) as tmp:
+        shutil.copyfileobj(upload, tmp, 1024 * 1024)
+    return tmp.name, True
+
+# The JSON request body if it is an object, else an empty one, so routes can
+# validate fields without tripping over null, arrays or invalid JSON
+def json_object():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+# A list of transcription ids; JSON true/false are not ids, even though
+# bool is an int subclass
+def is_id_list(ids):
+    return isinstance(ids, list) and bool(ids) and all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
 
 # Route: Transcribe Audio
+# With ?mode=async (or a "mode=async" form field) the upload is queued and a
+# job id is returned right away; poll /jobs/<job_id> for the result. Audio
+# that was recognized before with the same engine settings is answered from
+# the recognition cache straight away, in either mode. Queued uploads are
+# decoded by the job, so a file that can't be decoded fails the job rather
+# than the request.
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
-    if 'audio_data' not in request.files:
-        return jsonify({'error': 'No audio file provided'}), 400
+    # The first access to request.files reads and spools the multipart body
+    with stage('upload'):
+        if 'audio_data' not in request.files:
+            return jsonify({'error': 'No audio file provided'}), 400
+        upload = request.files['audio_data'].stream
+        upload_hash = hash_upload(upload)
+    options = recognition_options(app.config)
+    engine = engine_key(recognizer_backend, options)
+    mode = request.args.get('mode') or request.form.get('mode')
+
+    with stage('cache'):
+        cached = recognition_cache.get(upload_hash, engine)
+    if cached is None and mode != 'async':
+        try:
+            with stage('decode'):
+                audio, offset_ms = normalize_audio(upload, **options['ingest'],
+                                                   max_seconds=app.config['MAX_AUDIO_SECONDS'])
+                audio_hash = hash_audio(audio)
+        except AudioTooLongError as e:
+            return jsonify({'error': 'Recording is too long.', 'details': str(e)}), 413
+        except UnsupportedAudioError as e:
+            return jsonify({'error': 'Unsupported audio format.', 'details': str(e)}), 400
+        with stage('cache'):
+            cached = recognition_cache.get(audio_hash, engine)
+        if cached is not None:
+            cached = shift_segments(cached, offset_ms)
+            recognition_cache.put((upload_hash,), engine, cached)
+    stored_hash = store_upload(upload, upload_hash)
+    if cached is not None:
+        row = save_transcription(cached['transcription'], cached['segments'], cached['audio_hash'], stored_hash)
+        return jsonify({'transcription': row['transcription'], 'id': row['id'], 'cached': True}), 200
+
+    # Failed recognitions are neither cached nor used for deduplication
+    def complete(result):
+        offset_ms = result.pop('offset_ms')
+        if result.pop('failed'):
+            result.pop('audio_hash')
+            result = shift_segments(result, offset_ms)
+            return save_transcription(result['transcription'], result['segments'], upload_hash=stored_hash)
+        recognition_cache.put_recognized(upload_hash, engine, result, offset_ms)
+        result = shift_segments(result, offset_ms)
+        return save_transcription(result['transcription'], result['segments'], result['audio_hash'], stored_hash)
+
+    if mode == 'async':
+        # Process pool workers can't use the shared recognition pool, so they
+        # recognize the segments of long files on threads of their own
+        executor = recognition_pool if job_queue.executor_kind == 'thread' else None
+        path, remove = upload_path(upload, stored_hash)
+        try:
+            job = job_queue.submit(recognize_upload, path, recognizer_backend, executor, options,
+                                   app.config['MAX_AUDIO_SECONDS'], remove, on_complete=complete)
+        except QueueFull:
+            if remove:
+                os.unlink(path)
+            response = jsonify({'error': 'Transcription queue is full. Please try again later.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        return jsonify({
+            'job_id': job.id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job.id}'
+        }), 202
+
+    with stage('recognize'):
+        result = recognize_audio(audio, recognizer_backend, recognition_pool, options)
+    result.update(audio_hash=audio_hash, offset_ms=offset_ms)
+    row = complete(result)
+    return jsonify({'transcription': row['transcription'], 'id': row['id']}), 200
+
+# Route: Recognition Cache Statistics
+@app.route('/recognition_cache', methods=['GET'])
+def recognition_cache_stats():
+    return jsonify(recognition_cache.stats()), 200
+
+# Route: Start Live Transcription
+# Body: {"sample_rate": 16000}. Audio is then posted to audio_url as raw
+# 16-bit little-endian mono PCM, partial results arrive on events_url and
+# finish_url saves the final transcription.
+@app.route('/stream', methods=['POST'])
+def start_stream():
+    data = json_object()
+    sample_rate = data.get('sample_rate', 16000)
+    if not isinstance(sample_rate, int) or not 8000 <= sample_rate <= 48000:
+        return jsonify({'error': 'sample_rate must be an integer between 8000 and 48000.'}), 400
 
-    audio_file = request.files['audio_data']
+    try:
+        session = stream_manager.start(sample_rate)
+    except QueueFull:
+        return jsonify({'error': 'Too many live transcriptions in progress. Please try again later.'}), 503
+
+    return jsonify({
+        'session_id': session.id,
+        'audio_url': f'/stream/{session.id}/audio',
+        'events_url': f'/stream/{session.id}/events',
+        'finish_url': f'/stream/{session.id}/finish'
+    }), 201
+
+# Route: Live Transcription Audio Chunk
+@app.route('/stream/<session_id>/audio', methods=['POST'])
+def stream_audio(session_id):
+    session = stream_manager.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream not found.'}), 404
+
+    pcm = request.get_data()
+    if len(pcm) % 2:
+        return jsonify({'error': 'Audio must be 16-bit PCM.'}), 400
+
+    try:
+        stream_manager.feed(session, pcm)
+    except StreamFinished:
+        return jsonify({'error': 'Stream already finished.'}), 409
+    return jsonify({'success': True}), 200
+
+# Every open event stream holds a server thread, so past SSE_MAX_SUBSCRIBERS
+# new ones are turned away rather than starving ordinary requests
+def too_many_subscribers():
+    response = jsonify({'error': 'Too many open event streams. Please try again later.'})
+    response.headers['Retry-After'] = str(app.config['SSE_RETRY_AFTER'])
+    return response, 503
+
+# Route: Live Transcription Events (Server-Sent Events)
+# Sends a "partial" event per recognized segment and a "final" event with the
+# saved transcription row.
+@app.route('/stream/<session_id>/events', methods=['GET'])
+def stream_events(session_id):
+    session = stream_manager.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream not found.'}), 404
 
-    recognizer = sr.Recognizer()
+    try:
+        subscription = event_hub.subscribe(session.topic)
+    except TooManySubscribers:
+        return too_many_subscribers()
+    initial = [('partial', partial) for partial in session.partials()]
+    return Response(
+        sse_stream(event_hub, subscription, app.config['SSE_KEEPALIVE'], initial, last_events=('final',)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Route: Finish Live Transcription
+@app.route('/stream/<session_id>/finish', methods=['POST'])
+def finish_stream(session_id):
+    session = stream_manager.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream not found.'}), 404
 
     try:
-        with sr.AudioFile(audio_file) as source:
-            audio = recognizer.record(source)
-        transcription = recognizer.recognize_google(audio)
-    except sr.UnknownValueError:
+        transcription = stream_manager.finish(session, app.config['STREAM_FINISH_TIMEOUT'])
+    except StreamFinished:
+        return jsonify({'error': 'Stream already finished.'}), 409
+    if not transcription:
         transcription = "Sorry, could not understand the audio."
-    except sr.RequestError:
-        transcription = "Could not request results from the speech recognition service."
+    row = save_transcription(transcription, session.partials())
+    event_hub.publish(session.topic, 'final', {'transcription': row})
 
-    # Save transcription to database without translation initially
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO transcriptions (transcription) VALUES (?)', (transcription,))
-    conn.commit()
-    conn.close()
+    return jsonify({'transcription': transcription, 'id': row['id']}), 200
 
-    return jsonify({'transcription': transcription}), 200
+# Route: Transcription Segments
+# Timings and text of the pieces a long or live recording was recognized in
+@app.route('/transcriptions/<int:transcription_id>/segments', methods=['GET'])
+def get_segments(transcription_id):
+    if db.query_one(db.SELECT_TRANSCRIPTION, (transcription_id,)) is None:
+        return jsonify({'error': 'Transcription not found.'}), 404
+    segments = [dict(row) for row in db.query(db.SELECT_SEGMENTS, (transcription_id,))]
+    return jsonify({'segments': segments}), 200
+
+# Route: Play Transcription Audio
+# Serves the original upload. Range requests are answered with 206 partial
+# content, so players can seek without downloading the whole file, and the
+# file is handed to the server's wsgi.file_wrapper (sendfile under gunicorn)
+# rather than copied through Python. Stored files never change, so they are
+# cached as immutable.
+@app.route('/transcriptions/<int:transcription_id>/audio', methods=['GET'])
+def get_audio(transcription_id):
+    row = db.query_one(db.SELECT_TRANSCRIPTION, (transcription_id,))
+    if row is None:
+        return jsonify({'error': 'Transcription not found.'}), 404
+    if not row['upload_hash'] or not audio_store.exists(row['upload_hash']):
+        return jsonify({'error': 'No audio stored for this transcription.'}), 404
+
+    upload_hash = row['upload_hash']
+    response = send_file(os.path.abspath(audio_store.path(upload_hash)), mimetype=audio_store.mimetype(upload_hash),
+                         conditional=True, etag=upload_hash, max_age=app.config['AUDIO_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+# Route: Re-transcribe
+# Runs recognition again on the stored upload with the current engine and
+# settings and replaces the text and segments (clearing any translation).
+# ?mode=async works as it does for /transcribe.
+@app.route('/transcriptions/<int:transcription_id>/retranscribe', methods=['POST'])
+def retranscribe(transcription_id):
+    row = db.query_one(db.SELECT_TRANSCRIPTION, (transcription_id,))
+    if row is None:
+        return jsonify({'error': 'Transcription not found.'}), 404
+    upload_hash = row['upload_hash']
+    if not upload_hash or not audio_store.exists(upload_hash):
+        return jsonify({'error': 'No audio stored for this transcription.'}), 404
+
+    options = recognition_options(app.config)
+    engine = engine_key(recognizer_backend, options)
+
+    def complete(result):
+        offset_ms = result.pop('offset_ms')
+        if result.pop('failed'):
+            result.pop('audio_hash')
+            result = shift_segments(result, offset_ms)
+            row = update_recognition(transcription_id, result['transcription'], result['segments'], None)
+        else:
+            recognition_cache.put_recognized(upload_hash, engine, result, offset_ms)
+            result = shift_segments(result, offset_ms)
+            row = update_recognition(transcription_id, result['transcription'], result['segments'],
+                                     result['audio_hash'])
+        if row is None:
+            raise LookupError('Transcription was deleted.')
+        return row
+
+    mode = request.args.get('mode') or request.form.get('mode')
+    if mode == 'async':
+        executor = recognition_pool if job_queue.executor_kind == 'thread' else None
+        try:
+            job = job_queue.submit(recognize_upload, audio_store.path(upload_hash), recognizer_backend, executor,
+                                   options, on_complete=complete)
+        except QueueFull:
+            response = jsonify({'error': 'Transcription queue is full. Please try again later.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        return jsonify({
+            'job_id': job.id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job.id}'
+        }), 202
+
+    try:
+        with stage('decode'), audio_store.open(upload_hash) as f:
+            audio, offset_ms = normalize_audio(f, **options['ingest'])
+            audio_hash = hash_audio(audio)
+    except UnsupportedAudioError as e:
+        return jsonify({'error': 'Unsupported audio format.', 'details': str(e)}), 400
+    with stage('recognize'):
+        result = recognize_audio(audio, recognizer_backend, recognition_pool, options)
+    result.update(audio_hash=audio_hash, offset_ms=offset_ms)
+    try:
+        row = complete(result)
+    except LookupError:
+        return jsonify({'error': 'Transcription not found.'}), 404
+    return jsonify({'transcription': row['transcription'], 'id': row['id']}), 200
+
+# Route: Transcription Job Status
+# Pass ?wait=<seconds> to long-poll until the job finishes (capped by JOB_MAX_WAIT).
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['JOB_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'Invalid wait value.'}), 400
+
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+
+    data = job.to_dict()
+    if 'result' in data:
+        data['transcription'] = data.pop('result')
+    return jsonify(data), 200
+
+# Request bodies over MAX_CONTENT_LENGTH are refused from their Content-Length
+# header, before they are read
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    limit = app.config['MAX_CONTENT_LENGTH']
+    return jsonify({'error': f'Upload is larger than the {limit // (1024 * 1024)} MB limit.'}), 413
+
+# Fail fast while the translation service is down or saturated
+def translation_unavailable(error):
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = str(max(1, int(app.config['TRANSLATOR_BREAKER_RESET'])))
+    return response, 503
 
 # Route: Translate Transcription
 @app.route('/translate/<int:transcription_id>', methods=['POST'])
@@ -66,83 +490,255 @@ def translate_transcription(transcription_id):
     data = request.get_json()
     direction = data.get('direction')  # 'en_to_tl' or 'tl_to_en'
 
-    if direction not in ['en_to_tl', 'tl_to_en']:
+    if direction not in DIRECTIONS:
         return jsonify({'error': 'Invalid translation direction.'}), 400
 
     # Fetch the transcription from the database
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT transcription FROM transcriptions WHERE id = ?', (transcription_id,))
-    row = cursor.fetchone()
-    conn.close()
+    row = db.query_one(db.SELECT_TRANSCRIPTION, (transcription_id,))
 
     if not row:
         return jsonify({'error': 'Transcription not found.'}), 404
 
-    original_text = row[0]
-
-    translator = Translator()
-    try:
-        if direction == 'en_to_tl':
-            translated = translator.translate(original_text, src='en', dest='tl')
-        else:
-            translated = translator.translate(original_text, src='tl', dest='en')
-        translated_text = translated.text
-    except Exception as e:
-        return jsonify({'error': 'Translation failed.', 'details': str(e)}), 500
+    original_text = row['transcription']
+    src, dest = DIRECTIONS[direction]
+
+    # Reuse an earlier translation of the same text when there is one
+    with stage('cache'):
+        translated_text = translation_cache.get(original_text, src, dest)
+    if translated_text is None:
+        try:
+            with stage('translate'):
+                translated_text = translator_pool.translate(normalize_text(original_text), src, dest)
+        except (CircuitOpenError, RateLimitedError) as e:
+            return translation_unavailable(e)
+        except Exception as e:
+            return jsonify({'error': 'Translation failed.', 'details': str(e)}), 500
+        translation_cache.put(original_text, src, dest, translated_text)
 
     # Update the transcription with translated text and direction
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE transcriptions 
-        SET translated_text = ?, translation_direction = ?
-        WHERE id = ?
-    ''', (translated_text, direction, transcription_id))
-    conn.commit()
-    conn.close()
+    def write(conn):
+        conn.execute(db.UPDATE_TRANSLATION, (translated_text, direction, transcription_id))
+        row = conn.execute(db.SELECT_TRANSCRIPTION, (transcription_id,)).fetchone()
+        return row and dict(row), conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+
+    row, version = writer.write(write)
+    if row is not None:
+        publish_change('update', version, transcription=row)
 
     return jsonify({'translated_text': translated_text, 'direction': direction}), 200
 
-# Route: Get All Transcriptions
+# Route: Translate Many Transcriptions
+# Body: {"ids": [1, 2, ...], "direction": "en_to_tl" | "tl_to_en"}
+@app.route('/translate/batch', methods=['POST'])
+def translate_batch_route():
+    data = json_object()
+    ids = data.get('ids')
+    direction = data.get('direction')
+
+    if direction not in DIRECTIONS:
+        return jsonify({'error': 'Invalid translation direction.'}), 400
+    if not is_id_list(ids):
+        return jsonify({'error': 'ids must be a non-empty list of transcription ids.'}), 400
+    if len(ids) > app.config['TRANSLATE_BATCH_MAX_IDS']:
+        return jsonify({'error': f"At most {app.config['TRANSLATE_BATCH_MAX_IDS']} ids per batch."}), 400
+
+    rows = db.query(db.SELECT_TRANSCRIPTIONS_BY_IDS, (json.dumps(ids),))
+    src, dest = DIRECTIONS[direction]
+
+    try:
+        with stage('translate'):
+            translations = translate_batch(translator_pool, translation_cache,
+                                           [row['transcription'] for row in rows], src, dest,
+                                           app.config['TRANSLATE_BATCH_CHUNK_SIZE'])
+    except (CircuitOpenError, RateLimitedError) as e:
+        return translation_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': 'Translation failed.', 'details': str(e)}), 500
+
+    # Rows deleted since they were read are skipped: only the rows the
+    # updates actually wrote logged a change and are announced
+    updates = [(translations[normalize_text(row['transcription'])], direction, row['id']) for row in rows]
+    with db.transaction() as conn:
+        written = []
+        for update in updates:
+            row = conn.execute(db.UPDATE_TRANSLATION_RETURNING, update).fetchone()
+            if row is not None:
+                written.append(dict(row))
+        version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    publish_changes('update', version, [{'transcription': row} for row in written])
+
+    found = {row['id'] for row in written}
+    return jsonify({
+        'direction': direction,
+        'translations': [{'id': row['id'], 'translated_text': row['translated_text']} for row in written],
+        'missing': [i for i in dict.fromkeys(ids) if i not in found]
+    }), 200
+
+# Route: Translation Cache Statistics
+@app.route('/translation_cache', methods=['GET'])
+def translation_cache_stats():
+    return jsonify(dict(translation_cache.stats(), translator=translator_pool.stats())), 200
+
+# Escape search snippets and turn their match markers into <mark> tags
+def highlight_snippets(item):
+    for key in ('transcription_snippet', 'translated_snippet'):
+        if item[key]:
+            item[key] = html.escape(item[key]).replace('\x02', '<mark>').replace('\x03', '</mark>')
+    return item
+
+# Pagination cursors are opaque to clients: the sort key of the last row
+# returned, tagged with the kind of listing it belongs to
+def encode_cursor(kind, key, row_id):
+    return base64.urlsafe_b64encode(json.dumps([kind, key, row_id]).encode()).decode()
+
+def decode_cursor(cursor, kind):
+    try:
+        cursor_kind, key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor.')
+    # Recent pages are keyed by timestamp text, search pages by bm25 rank
+    key_types = (str,) if kind == 'recent' else (int, float)
+    if (cursor_kind != kind or not isinstance(key, key_types) or isinstance(key, bool)
+            or not isinstance(row_id, int) or isinstance(row_id, bool)):
+        raise ValueError('Invalid cursor.')
+    return key, row_id
+
+def parse_fields(value):
+    if not value:
+        return db.TRANSCRIPTION_FIELDS
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in db.TRANSCRIPTION_FIELDS]
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(unknown))
+    return ('id',) + tuple(field for field in fields if field != 'id')
+
+def parse_limit(value):
+    if value is None:
+        return app.config['PAGE_SIZE']
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Invalid limit.')
+    if limit < 1:
+        raise ValueError('Invalid limit.')
+    return min(limit, app.config['MAX_PAGE_SIZE'])
+
+# Route: Get Transcriptions
+# Returns one page at a time: newest first, or best match first when
+# searching. ?limit= sets the page size, ?cursor= continues from a previous
+# response's next_cursor and ?fields= picks which columns to return.
 @app.route('/get_transcriptions', methods=['GET'])
 def get_transcriptions():
     search_query = request.args.get('search', '')
+    match = db.fts_query(search_query)
+    kind = 'search' if match else 'recent'
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    if search_query:
-        cursor.execute('''
-            SELECT id, transcription, translated_text, translation_direction, timestamp FROM transcriptions 
-            WHERE transcription LIKE ? 
-            ORDER BY timestamp DESC
-        ''', ('%'+search_query+'%',))
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'))
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, kind) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # A page only changes when the table does, so the ETag is derived from the
+    # change log version and the query; clients revalidating a current copy
+    # get a 304 without the page being queried again
+    version = db.query_one(db.SELECT_CHANGE_VERSION)[0]
+    etag = hashlib.sha1(f'{version}?{request.query_string.decode()}'.encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    # Fetch one extra row to find out whether there is a next page
+    if match:
+        rows = db.search_transcriptions(match, fields, limit + 1, after)
     else:
-        cursor.execute('SELECT id, transcription, translated_text, translation_direction, timestamp FROM transcriptions ORDER BY timestamp DESC')
-    rows = cursor.fetchall()
-    conn.close()
+        rows = db.list_transcriptions(fields, limit + 1, after)
 
-    transcriptions = [
-        {
-            'id': row[0],
-            'transcription': row[1],
-            'translated_text': row[2],
-            'translation_direction': row[3],
-            'timestamp': row[4]
-        }
-        for row in rows
-    ]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(kind, last['rank'] if match else last['timestamp'], last['id'])
+
+    transcriptions = []
+    for row in rows:
+        item = {field: row[field] for field in fields}
+        if match:
+            item['transcription_snippet'] = row['transcription_snippet']
+            item['translated_snippet'] = row['translated_snippet']
+            highlight_snippets(item)
+        transcriptions.append(item)
+
+    response = jsonify({'transcriptions': transcriptions, 'next_cursor': next_cursor, 'version': version})
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# Route: Transcription Events (Server-Sent Events)
+# Broadcasts "insert", "update" and "delete" events as transcriptions change,
+# each with the change log version it produced. Events are only seen by
+# clients of the process that made the change; a jump in versions means some
+# were missed and /transcriptions/changes fills the gap.
+@app.route('/events', methods=['GET'])
+def transcription_events():
+    try:
+        subscription = event_hub.subscribe(TRANSCRIPTIONS_TOPIC)
+    except TooManySubscribers:
+        return too_many_subscribers()
+    return Response(
+        sse_stream(event_hub, subscription, app.config['SSE_KEEPALIVE']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-    return jsonify({'transcriptions': transcriptions}), 200
+# Route: Transcription Changes
+# Rows inserted, updated or deleted since ?since=<version> (the version of a
+# previous /get_transcriptions or /transcriptions/changes response), so a
+# client can patch its list instead of reloading it. "reset": true means the
+# changes can't be replayed (too many, or older than the change log) and the
+# list should be fetched again.
+@app.route('/transcriptions/changes', methods=['GET'])
+def get_transcription_changes():
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'Invalid since value.'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    limit = app.config['MAX_PAGE_SIZE']
+    # Read the version first: a change racing with this request is then sent
+    # again next time rather than missed
+    version, oldest = db.query_one(db.SELECT_CHANGE_VERSIONS)
+    if since > version or (oldest and since < oldest - 1):
+        return jsonify({'reset': True, 'version': version}), 200
+
+    rows = db.list_changes(since, fields, limit + 1)
+    if len(rows) > limit:
+        return jsonify({'reset': True, 'version': version}), 200
+
+    inserted, updated, deleted = [], [], []
+    for row in rows:
+        if row['deleted']:
+            deleted.append(row['id'])
+            continue
+        item = {field: row[field] for field in fields}
+        (inserted if row['inserted'] else updated).append(item)
+    return jsonify({'version': version, 'inserted': inserted, 'updated': updated, 'deleted': deleted}), 200
 
 # Route: Delete Transcription
 @app.route('/delete_transcription/<int:transcription_id>', methods=['DELETE'])
 def delete_transcription(transcription_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM transcriptions WHERE id = ?', (transcription_id,))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        deleted = conn.execute(db.DELETE_TRANSCRIPTION, (transcription_id,)).rowcount
+        version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    if deleted:
+        publish_change('delete', version, id=transcription_id)
     return jsonify({'success': True}), 200
 
 # Route: Edit Transcription
@@ -154,48 +750,236 @@ def edit_transcription(transcription_id):
     if not new_text:
         return jsonify({'error': 'No transcription provided'}), 400
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE transcriptions 
-        SET transcription = ?, translated_text = NULL, translation_direction = NULL, timestamp = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (new_text, transcription_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        conn.execute(db.UPDATE_TRANSCRIPTION, (new_text, transcription_id))
+        row = conn.execute(db.SELECT_TRANSCRIPTION, (transcription_id,)).fetchone()
+        version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    if row is not None:
+        publish_change('update', version, transcription=dict(row))
     return jsonify({'success': True, 'transcription': new_text}), 200
 
+# Ids a bulk request applies to, looked up on conn: the "ids" list, or every
+# row matching "filter" ({"search": ..., "start": ..., "end": ...}, at least
+# one of them). Returns the existing ids and the requested ids that don't
+# exist; raises ValueError for a malformed request.
+def bulk_target_ids(conn, data):
+    ids = data.get('ids')
+    criteria = data.get('filter')
+    if ids is not None:
+        if not is_id_list(ids):
+            raise ValueError('ids must be a non-empty list of transcription ids.')
+        if len(ids) > app.config['BULK_MAX_IDS']:
+            raise ValueError(f"At most {app.config['BULK_MAX_IDS']} ids per request.")
+        ids = list(dict.fromkeys(ids))
+        found = {row[0] for row in conn.execute(db.SELECT_EXISTING_IDS, (json.dumps(ids),))}
+        return [i for i in ids if i in found], [i for i in ids if i not in found]
+    if isinstance(criteria, dict):
+        for key in ('search', 'start', 'end'):
+            if criteria.get(key) is not None and not isinstance(criteria[key], str):
+                raise ValueError(f'filter {key} must be a string.')
+        start = parse_timestamp(criteria.get('start'))
+        end = parse_timestamp(criteria.get('end'), end=True)
+        match = db.fts_query(criteria.get('search') or '')
+        if start is None and end is None and match is None:
+            raise ValueError('filter needs at least one of search, start or end.')
+        # Filters are capped like id lists, so one request can't rewrite the
+        # whole table in a single transaction and flood clients with events
+        limit = app.config['BULK_MAX_IDS']
+        ids = db.matching_ids(conn, start, end, match, limit + 1)
+        if len(ids) > limit:
+            raise ValueError(f'filter matches more than {limit} transcriptions; narrow it down.')
+        return ids, []
+    raise ValueError('Provide either ids or a filter.')
+
+# Current rows for ids, in the same order, for change events
+def rows_by_ids(conn, ids):
+    rows = {row['id']: dict(row) for row in conn.execute(db.SELECT_TRANSCRIPTIONS_BY_IDS, (json.dumps(ids),))}
+    return [rows[i] for i in ids]
+
+# Route: Delete Many Transcriptions
+# Body: {"ids": [1, 2, ...]} or {"filter": {"search": ..., "start": ..., "end": ...}}.
+# Everything is deleted in one transaction.
+@app.route('/delete_transcriptions', methods=['POST'])
+def delete_transcriptions():
+    data = json_object()
+    try:
+        with db.transaction() as conn:
+            ids, missing = bulk_target_ids(conn, data)
+            deleted = db.executemany_chunked(conn, db.DELETE_TRANSCRIPTION, [(i,) for i in ids],
+                                             app.config['BULK_CHUNK_SIZE'])
+            version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    publish_changes('delete', version, [{'id': i} for i in ids])
+    return jsonify({'deleted': deleted, 'missing': missing}), 200
+
+# Route: Edit Many Transcriptions
+# Body: {"edits": [{"id": 1, "transcription": "..."}, ...]}. All edits are
+# applied in one transaction; like single edits, they clear the translation.
+@app.route('/edit_transcriptions', methods=['POST'])
+def edit_transcriptions():
+    data = json_object()
+    edits = data.get('edits')
+    if not isinstance(edits, list) or not edits or not all(
+            isinstance(e, dict) and isinstance(e.get('id'), int) and not isinstance(e['id'], bool)
+            and isinstance(e.get('transcription'), str) and e['transcription'] for e in edits):
+        return jsonify({'error': 'edits must be a non-empty list of {"id", "transcription"} objects.'}), 400
+    if len(edits) > app.config['BULK_MAX_IDS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_IDS']} edits per request."}), 400
+
+    # The last edit of an id wins
+    texts = {e['id']: e['transcription'] for e in edits}
+    with db.transaction() as conn:
+        found = {row[0] for row in conn.execute(db.SELECT_EXISTING_IDS, (json.dumps(list(texts)),))}
+        ids = [i for i in texts if i in found]
+        updated = db.executemany_chunked(conn, db.UPDATE_TRANSCRIPTION, [(texts[i], i) for i in ids],
+                                         app.config['BULK_CHUNK_SIZE'])
+        rows = rows_by_ids(conn, ids)
+        version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    publish_changes('update', version, [{'transcription': row} for row in rows])
+    return jsonify({'updated': updated, 'missing': [i for i in texts if i not in found]}), 200
+
+# Route: Clear Translations
+# Body: {"ids": [...]} or {"filter": {...}} as for /delete_transcriptions.
+@app.route('/clear_translations', methods=['POST'])
+def clear_translations():
+    data = json_object()
+    try:
+        with db.transaction() as conn:
+            ids, missing = bulk_target_ids(conn, data)
+            cleared = db.executemany_chunked(conn, db.CLEAR_TRANSLATION, [(i,) for i in ids],
+                                             app.config['BULK_CHUNK_SIZE'])
+            rows = rows_by_ids(conn, ids)
+            version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    publish_changes('update', version, [{'transcription': row} for row in rows])
+    return jsonify({'cleared': cleared, 'missing': missing}), 200
+
+# Parse a start/end filter: a date or a full timestamp. A bare end date
+# includes that whole day.
+def parse_timestamp(value, end=False):
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
+    if end and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+# Route: Search the Archive
+# Transcriptions moved out by the retention policy, newest first. ?search=
+# words must all appear in the text or translation; ?start=/?end= bound the
+# time range the same way as for exports. Only archive blocks overlapping the
+# range are decompressed, so narrow ranges are much faster.
+@app.route('/archive/search', methods=['GET'])
+def search_archive():
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'), end=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    words = request.args.get('search', '').split()
+    with stage('archive'):
+        rows = maintenance.archive.search(words, start, end, limit)
+    return jsonify({'transcriptions': rows}), 200
+
 # Route: Download Transcriptions
+# ?format=txt|csv|jsonl picks the file format and ?compress=gzip gzips it.
+# ?start=, ?end= (dates or timestamps) and ?search= filter the rows. The file
+# is streamed as rows are read, so it starts downloading right away and never
+# has to fit in memory.
 @app.route('/download_transcriptions', methods=['GET'])
 def download_transcriptions():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT transcription, translated_text, translation_direction, timestamp FROM transcriptions ORDER BY timestamp DESC')
-    rows = cursor.fetchall()
-    conn.close()
+    fmt = request.args.get('format', 'txt')
+    compress = request.args.get('compress') == 'gzip'
+    if fmt not in FORMATS:
+        return jsonify({'error': 'Invalid format.'}), 400
 
-    output = io.StringIO()
-    for row in rows:
-        transcription = row[0]
-        translated_text = row[1] if row[1] else ""
-        direction = row[2] if row[2] else ""
-        timestamp = row[3]
-        if translated_text and direction:
-            if direction == 'en_to_tl':
-                direction_text = "English to Tagalog"
-            else:
-                direction_text = "Tagalog to English"
-            output.write(f"{timestamp} - {transcription} | {direction_text} | {translated_text}\n")
-        else:
-            output.write(f"{timestamp} - {transcription}\n")
-    output.seek(0)
-
-    return send_file(
-        io.BytesIO(output.read().encode()),
-        mimetype='text/plain',
-        as_attachment=True,
-        attachment_filename='transcriptions.txt'
-    )
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'), end=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    match = db.fts_query(request.args.get('search', ''))
+
+    mimetype, extension, _, _ = FORMATS[fmt]
+    filename = f'transcriptions.{extension}'
+    if compress:
+        mimetype, filename = 'application/gzip', filename + '.gz'
+
+    rows = db.iter_transcriptions(start, end, match, app.config['EXPORT_CHUNK_SIZE'])
+    response = Response(stream_with_context(stream_export(rows, fmt, compress)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+# Command: Bulk Import
+# flask --app app import-audio <directory>... [--manifest FILE]
+# Transcribes audio files offline on a process pool and backfills the
+# transcriptions table. Safe to interrupt: rerunning skips files that were
+# already imported and retries the ones that failed.
+@app.cli.command('import-audio')
+@click.argument('directories', nargs=-1, type=click.Path(exists=True, file_okay=False))
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), help='File listing audio paths, one per line.')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count).')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows written per transaction.')
+def import_audio(directories, manifest, workers, batch_size):
+    if not directories and not manifest:
+        raise click.UsageError('Give at least one directory or a --manifest.')
+    db.init_db()
+
+    def paths():
+        for directory in directories:
+            yield from walk_audio_files(directory)
+        if manifest:
+            yield from read_manifest(manifest)
+
+    store = audio_store if audio_store.enabled else None
+    importer = Importer(recognizer_backend, recognition_options(app.config), workers, batch_size, echo=click.echo,
+                        store=store)
+    summary = importer.run(paths())
+    click.echo(f"Imported {summary['done']} files, {summary['failed']} failed, {summary['skipped']} already imported.")
+
+# Command: Prune Audio
+# flask --app app prune-audio [--grace SECONDS]
+# Deletes stored audio that no transcription refers to any more.
+@app.cli.command('prune-audio')
+@click.option('--grace', type=float, default=3600, show_default=True,
+              help='Keep files younger than this many seconds.')
+def prune_audio(grace):
+    db.init_db()
+    referenced = {row[0] for row in db.query(db.SELECT_UPLOAD_HASHES)} | maintenance.archive.upload_hashes()
+    removed = audio_store.prune(referenced, grace)
+    click.echo(f'Removed {removed} unreferenced audio files.')
+
+# Command: Maintain
+# flask --app app maintain [--retention-days DAYS]
+# Runs database maintenance once (archiving, cache expiry, incremental vacuum,
+# ANALYZE).
+@app.cli.command('maintain')
+@click.option('--retention-days', type=float, default=None,
+              help='Archive transcriptions older than this (default: RETENTION_DAYS).')
+def maintain(retention_days):
+    db.init_db()
+    summary = maintenance.run_once(retention_days)
+    click.echo(f"Archived {summary['archived']} transcriptions, deleted {summary['expired_cache_rows']} expired "
+               f"cache entries, freed {summary['vacuumed_pages']} pages.")
+
+# Command: Vacuum
+# flask --app app vacuum
+# Rebuilds the database with a full VACUUM, switching it to incremental
+# auto-vacuum so the maintenance task can free pages from then on. Needs as
+# much free disk as the database and locks it while it runs.
+@app.cli.command('vacuum')
+def vacuum():
+    db.init_db()
+    conn = db.connection()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    click.echo('Database vacuumed.')
 
 # HTML Template with Embedded CSS and JavaScript
 html_template = '''
@@ -456,7 +1240,13 @@ html_template = '''
             margin-right: 10px;
         }
 
-        .translation-options select {
+        .live-option {
+            margin: 0 10px;
+            font-size: 14px;
+        }
+
+        .translation-options select,
+        #downloadFormat {
             padding: 8px;
             border: 2px solid var(--accent-color);
             border-radius: 5px;
@@ -478,8 +1268,15 @@ html_template = '''
     <div class="container">
         <h1>Speech Recognition App</h1>
         <button id="recordButton" aria-label="Start recording">Record</button>
+        <label class="live-option"><input type="checkbox" id="liveToggle"> Live transcription</label>
         <button id="downloadButton">Download Transcriptions</button>
+        <select id="downloadFormat" aria-label="Download format">
+            <option value="txt">Text</option>
+            <option value="csv">CSV</option>
+            <option value="jsonl">JSON Lines</option>
+        </select>
         <p id="status" aria-live="polite">Press the button to start recording.</p>
+        <p id="livePartial" aria-live="polite"></p>
 
         <input type="text" id="searchBar" placeholder="Search transcriptions...">
 
@@ -488,6 +1285,7 @@ html_template = '''
             <ul id="transcriptionList">
                 <!-- Transcriptions will be populated here -->
             </ul>
+            <button id="loadMoreButton" style="display: none;">Load More</button>
         </div>
     </div>
 
@@ -523,9 +1321,13 @@ html_template = '''
 
         const recordButton = document.getElementById('recordButton');
         const status = document.getElementById('status');
+        const liveToggle = document.getElementById('liveToggle');
+        const livePartial = document.getElementById('livePartial');
         const transcriptionList = document.getElementById('transcriptionList');
         const searchBar = document.getElementById('searchBar');
         const downloadButton = document.getElementById('downloadButton');
+        const downloadFormat = document.getElementById('downloadFormat');
+        const loadMoreButton = document.getElementById('loadMoreButton');
 
         const editModal = document.getElementById('editModal');
         const closeModal = document.getElementById('closeModal');
@@ -543,8 +1345,14 @@ html_template = '''
 
         let mediaRecorder;
         let audioChunks = [];
+        let liveSession = null;
         let currentEditId = null;
         let currentTranslateId = null;
+        let nextCursor = null;
+        let listRequest = 0;
+        let listVersion = null;
+        let syncQueue = Promise.resolve();
+        let pendingSyncs = 0;
 
         // Initialize Color Blind Mode based on saved preference
         if (localStorage.getItem('colorBlindMode') === 'enabled') {
@@ -566,7 +1374,8 @@ html_template = '''
             }
         });
 
-        searchBar.addEventListener('input', fetchTranscriptions);
+        searchBar.addEventListener('input', () => fetchTranscriptions());
+        loadMoreButton.addEventListener('click', () => fetchTranscriptions(nextCursor));
         downloadButton.addEventListener('click', downloadTranscriptions);
 
         // Edit Modal Event Listeners
@@ -605,6 +1414,10 @@ html_template = '''
 
         // Functions
         function startRecording() {
+            if (liveToggle.checked) {
+                startLiveRecording();
+                return;
+            }
             navigator.mediaDevices.getUserMedia({ audio: true })
                 .then(stream => {
                     mediaRecorder = new MediaRecorder(stream);
@@ -618,7 +1431,7 @@ html_template = '''
                     });
 
                     mediaRecorder.addEventListener("stop", () => {
-                        const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
+                        const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType });
                         uploadAudio(audioBlob);
                         audioChunks = [];
                         recordButton.classList.remove('recording');
@@ -631,14 +1444,135 @@ html_template = '''
         }
 
         function stopRecording() {
+            if (liveSession) {
+                stopLiveRecording();
+                return;
+            }
             mediaRecorder.stop();
             status.textContent = 'Processing...';
             recordButton.textContent = 'Record';
         }
 
+        // Live transcription: stream 16-bit PCM to the server while recording
+        // and show partial results pushed back over Server-Sent Events
+        function startLiveRecording() {
+            navigator.mediaDevices.getUserMedia({ audio: true })
+                .then(stream => {
+                    const context = new AudioContext();
+                    const sampleRate = Math.min(16000, context.sampleRate);
+
+                    return fetch('/stream', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json'
+                        },
+                        body: JSON.stringify({ sample_rate: sampleRate })
+                    })
+                    .then(response => response.json())
+                    .then(data => {
+                        if (!data.session_id) {
+                            stream.getTracks().forEach(track => track.stop());
+                            context.close();
+                            status.textContent = data.error || 'Could not start live transcription.';
+                            return;
+                        }
+
+                        const source = context.createMediaStreamSource(stream);
+                        const processor = context.createScriptProcessor(4096, 1, 1);
+                        const events = new EventSource(data.events_url);
+                        const partials = {};
+
+                        events.addEventListener('partial', event => {
+                            const partial = JSON.parse(event.data);
+                            partials[partial.index] = partial.text;
+                            livePartial.textContent = Object.keys(partials)
+                                .sort((a, b) => a - b)
+                                .map(index => partials[index])
+                                .filter(text => text)
+                                .join(' ');
+                        });
+
+                        liveSession = { data, stream, context, source, processor, events, uploads: Promise.resolve() };
+
+                        // Chunks are uploaded one after another so they arrive in order
+                        processor.onaudioprocess = event => {
+                            const pcm = downsampleToInt16(event.inputBuffer.getChannelData(0), context.sampleRate, sampleRate);
+                            const session = liveSession;
+                            session.uploads = session.uploads.then(() => fetch(session.data.audio_url, {
+                                method: 'POST',
+                                headers: {
+                                    'Content-Type': 'application/octet-stream'
+                                },
+                                body: pcm
+                            }));
+                        };
+                        source.connect(processor);
+                        processor.connect(context.destination);
+
+                        status.textContent = 'Recording (live)...';
+                        recordButton.textContent = 'Stop';
+                        recordButton.classList.add('recording');
+                    });
+                })
+                .catch(error => {
+                    console.error('Error accessing microphone:', error);
+                    status.textContent = 'Microphone access denied.';
+                });
+        }
+
+        function stopLiveRecording() {
+            const session = liveSession;
+            liveSession = null;
+            session.processor.disconnect();
+            session.source.disconnect();
+            session.context.close();
+            session.stream.getTracks().forEach(track => track.stop());
+            status.textContent = 'Processing...';
+            recordButton.textContent = 'Record';
+            recordButton.classList.remove('recording');
+
+            session.uploads
+                .then(() => fetch(session.data.finish_url, { method: 'POST' }))
+                .then(response => response.json())
+                .then(data => {
+                    session.events.close();
+                    livePartial.textContent = '';
+                    if (data.transcription) {
+                        status.textContent = 'Transcription Complete.';
+                        addTranscriptionToList(data.transcription);
+                    } else if (data.error) {
+                        status.textContent = data.error;
+                    }
+                })
+                .catch(error => {
+                    session.events.close();
+                    console.error('Error:', error);
+                    status.textContent = 'An error occurred during transcription.';
+                });
+        }
+
+        // Average float samples down to outputRate and convert them to 16-bit PCM
+        function downsampleToInt16(input, inputRate, outputRate) {
+            const ratio = inputRate / outputRate;
+            const length = Math.floor(input.length / ratio);
+            const output = new Int16Array(length);
+            for (let i = 0; i < length; i++) {
+                const start = Math.floor(i * ratio);
+                const end = Math.max(start + 1, Math.min(input.length, Math.floor((i + 1) * ratio)));
+                let sum = 0;
+                for (let j = start; j < end; j++) {
+                    sum += input[j];
+                }
+                const sample = Math.max(-1, Math.min(1, sum / (end - start)));
+                output[i] = sample < 0 ? sample * 0x8000 : sample * 0x7FFF;
+            }
+            return output;
+        }
+
         function uploadAudio(blob) {
             const formData = new FormData();
-            formData.append('audio_data', blob, 'recording.wav');
+            formData.append('audio_data', blob, 'recording');
+            formData.append('mode', 'async');
 
             fetch('/transcribe', {
                 method: 'POST',
@@ -646,7 +1580,9 @@ html_template = '''
             })
             .then(response => response.json())
             .then(data => {
-                if (data.transcription) {
+                if (data.job_id) {
+                    waitForJob(data.job_id);
+                } else if (data.transcription) {
                     status.textContent = 'Transcription Complete.';
                     addTranscriptionToList(data.transcription);
                 } else if (data.error) {
@@ -659,82 +1595,229 @@ html_template = '''
             });
         }
 
+        // Long-poll a transcription job until it finishes
+        function waitForJob(jobId) {
+            fetch('/jobs/' + jobId + '?wait=25')
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status === 'done') {
+                        status.textContent = 'Transcription Complete.';
+                        addTranscriptionToList(data.transcription.transcription);
+                    } else if (data.status === 'failed' || data.error) {
+                        status.textContent = data.error || 'An error occurred during transcription.';
+                    } else {
+                        waitForJob(jobId);
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    status.textContent = 'An error occurred during transcription.';
+                });
+        }
+
         function addTranscriptionToList(transcription) {
-            fetchTranscriptions();
+            syncTranscriptions();
+        }
+
+        // Bring the list up to date after a change by applying only the rows
+        // inserted, updated or deleted since it was loaded. Search results
+        // are ranked, so they are fetched again instead.
+        function syncTranscriptions() {
+            if (searchBar.value || listVersion === null) {
+                fetchTranscriptions();
+                return;
+            }
+            pendingSyncs++;
+            syncQueue = syncQueue
+                .then(() => fetch('/transcriptions/changes?since=' + listVersion))
+                .then(response => response.json())
+                .then(data => {
+                    if (data.reset) {
+                        fetchTranscriptions();
+                        return;
+                    }
+                    if (data.version === undefined) return;
+                    applyChanges(data);
+                    listVersion = data.version;
+                })
+                .catch(error => {
+                    console.error('Error syncing transcriptions:', error);
+                })
+                .finally(() => pendingSyncs--);
         }
 
-        // Fetch Transcriptions with Optional Search
-        function fetchTranscriptions() {
+        // Apply changes pushed by the server as they happen. Each event
+        // carries the version it produced; when versions skip (a missed
+        // event, or a change made by another server process) the list is
+        // synced from the change log instead.
+        // The server turns streams away when it has too many open; the
+        // browser then gives up on the connection, so try again later. Until
+        // then the list is still synced after this tab's own changes.
+        function listenForChanges() {
+            const events = new EventSource('/events');
+            events.addEventListener('error', () => {
+                if (events.readyState === EventSource.CLOSED) setTimeout(listenForChanges, 30000);
+            });
+            events.addEventListener('open', () => {
+                if (listVersion !== null && !searchBar.value) syncTranscriptions();
+            });
+            ['insert', 'update', 'delete'].forEach(type => {
+                events.addEventListener(type, event => {
+                    const data = JSON.parse(event.data);
+                    if (listVersion === null || data.version <= listVersion) return;
+                    if (searchBar.value) {
+                        if (type === 'delete') applyChanges({ inserted: [], updated: [], deleted: [data.id] });
+                        return;
+                    }
+                    // While a sync is running its result may be older than
+                    // this event, so let another sync pick the event up
+                    if (pendingSyncs || data.version !== listVersion + 1) {
+                        syncTranscriptions();
+                        return;
+                    }
+                    listVersion = data.version;
+                    applyChanges({
+                        inserted: type === 'insert' ? [data.transcription] : [],
+                        updated: type === 'update' ? [data.transcription] : [],
+                        deleted: type === 'delete' ? [data.id] : []
+                    });
+                });
+            });
+        }
+
+        function applyChanges(changes) {
+            const existing = id => transcriptionList.querySelector(`li[data-id="${id}"]`);
+            changes.deleted.forEach(id => {
+                const li = existing(id);
+                if (li) li.remove();
+            });
+            changes.updated.forEach(item => {
+                const li = existing(item.id);
+                if (li) li.replaceWith(renderTranscription(item));
+            });
+            // New rows are the newest, so they go to the top
+            changes.inserted.forEach(item => {
+                const li = existing(item.id);
+                if (li) {
+                    li.replaceWith(renderTranscription(item));
+                } else {
+                    transcriptionList.prepend(renderTranscription(item));
+                }
+            });
+        }
+
+        // Build the list entry for one transcription
+        function renderTranscription(item) {
+            const li = document.createElement('li');
+            li.className = 'transcription-item';
+            li.dataset.id = item.id;
+
+            const textDiv = document.createElement('div');
+            textDiv.className = 'transcription-text';
+            textDiv.innerHTML = `<strong>Original:</strong> ${item.transcription_snippet || item.transcription}`;
+
+            if (item.translated_text && item.translation_direction) {
+                let directionText = "";
+                if (item.translation_direction === 'en_to_tl') {
+                    directionText = "English to Tagalog";
+                } else if (item.translation_direction === 'tl_to_en') {
+                    directionText = "Tagalog to English";
+                }
+                textDiv.innerHTML += `<br><strong>Translated (${directionText}):</strong> ${item.translated_snippet || item.translated_text}`;
+            }
+
+            const actionsDiv = document.createElement('div');
+            actionsDiv.className = 'transcription-actions';
+
+            // Text-to-Speech Button
+            const speakButton = document.createElement('button');
+            speakButton.textContent = 'Speak';
+            speakButton.style.marginRight = '5px';
+            speakButton.addEventListener('click', () => {
+                speakText(item.transcription);
+            });
+
+            // Translate Button
+            const translateButton = document.createElement('button');
+            translateButton.textContent = 'Translate';
+            translateButton.style.marginRight = '5px';
+            translateButton.addEventListener('click', () => {
+                openTranslateModal(item.id);
+            });
+
+            const editButton = document.createElement('button');
+            editButton.textContent = 'Edit';
+            editButton.addEventListener('click', () => {
+                openEditModal(item.id, item.transcription);
+            });
+
+            const deleteButton = document.createElement('button');
+            deleteButton.textContent = 'Delete';
+            deleteButton.addEventListener('click', () => {
+                deleteTranscription(item.id);
+            });
+
+            // Play the original recording, when it was kept
+            if (item.upload_hash) {
+                const playButton = document.createElement('button');
+                playButton.textContent = 'Play';
+                playButton.style.marginRight = '5px';
+                playButton.addEventListener('click', () => {
+                    let player = li.querySelector('audio');
+                    if (!player) {
+                        player = document.createElement('audio');
+                        player.controls = true;
+                        player.src = `/transcriptions/${item.id}/audio`;
+                        li.appendChild(player);
+                    }
+                    player.play();
+                });
+                actionsDiv.appendChild(playButton);
+            }
+
+            actionsDiv.appendChild(speakButton);
+            actionsDiv.appendChild(translateButton);
+            actionsDiv.appendChild(editButton);
+            actionsDiv.appendChild(deleteButton);
+
+            li.appendChild(textDiv);
+            li.appendChild(actionsDiv);
+            return li;
+        }
+
+        // Fetch Transcriptions with Optional Search, one page at a time.
+        // Without a cursor the list is reloaded from the first page.
+        function fetchTranscriptions(cursor) {
             const query = searchBar.value;
-            let url = '/get_transcriptions';
+            const params = new URLSearchParams();
             if (query) {
-                url += '?search=' + encodeURIComponent(query);
+                params.set('search', query);
+            }
+            if (cursor) {
+                params.set('cursor', cursor);
+            }
+            let url = '/get_transcriptions';
+            if (params.toString()) {
+                url += '?' + params.toString();
             }
 
+            // Ignore responses that arrive after a newer search has started
+            const request = ++listRequest;
             fetch(url)
                 .then(response => response.json())
                 .then(data => {
-                    transcriptionList.innerHTML = '';
+                    if (request !== listRequest) return;
+                    if (!cursor) {
+                        transcriptionList.innerHTML = '';
+                        listVersion = data.version;
+                    }
                     if (data.transcriptions) {
                         data.transcriptions.forEach(item => {
-                            const li = document.createElement('li');
-                            li.className = 'transcription-item';
-
-                            const textDiv = document.createElement('div');
-                            textDiv.className = 'transcription-text';
-                            textDiv.innerHTML = `<strong>Original:</strong> ${item.transcription}`;
-
-                            if (item.translated_text && item.translation_direction) {
-                                let directionText = "";
-                                if (item.translation_direction === 'en_to_tl') {
-                                    directionText = "English to Tagalog";
-                                } else if (item.translation_direction === 'tl_to_en') {
-                                    directionText = "Tagalog to English";
-                                }
-                                textDiv.innerHTML += `<br><strong>Translated (${directionText}):</strong> ${item.translated_text}`;
-                            }
-
-                            const actionsDiv = document.createElement('div');
-                            actionsDiv.className = 'transcription-actions';
-
-                            // Text-to-Speech Button
-                            const speakButton = document.createElement('button');
-                            speakButton.textContent = 'Speak';
-                            speakButton.style.marginRight = '5px';
-                            speakButton.addEventListener('click', () => {
-                                speakText(item.transcription);
-                            });
-
-                            // Translate Button
-                            const translateButton = document.createElement('button');
-                            translateButton.textContent = 'Translate';
-                            translateButton.style.marginRight = '5px';
-                            translateButton.addEventListener('click', () => {
-                                openTranslateModal(item.id);
-                            });
-
-                            const editButton = document.createElement('button');
-                            editButton.textContent = 'Edit';
-                            editButton.addEventListener('click', () => {
-                                openEditModal(item.id, item.transcription);
-                            });
-
-                            const deleteButton = document.createElement('button');
-                            deleteButton.textContent = 'Delete';
-                            deleteButton.addEventListener('click', () => {
-                                deleteTranscription(item.id);
-                            });
-
-                            actionsDiv.appendChild(speakButton);
-                            actionsDiv.appendChild(translateButton);
-                            actionsDiv.appendChild(editButton);
-                            actionsDiv.appendChild(deleteButton);
-
-                            li.appendChild(textDiv);
-                            li.appendChild(actionsDiv);
-                            transcriptionList.appendChild(li);
+                            transcriptionList.appendChild(renderTranscription(item));
                         });
                     }
+                    nextCursor = data.next_cursor || null;
+                    loadMoreButton.style.display = nextCursor ? 'inline-block' : 'none';
                 })
                 .catch(error => {
                     console.error('Error fetching transcriptions:', error);
@@ -751,7 +1834,7 @@ html_template = '''
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    fetchTranscriptions();
+                    syncTranscriptions();
                 }
             })
             .catch(error => {
@@ -785,7 +1868,7 @@ html_template = '''
             .then(data => {
                 if (data.success) {
                     editModal.style.display = 'none';
-                    fetchTranscriptions();
+                    syncTranscriptions();
                 } else if (data.error) {
                     alert(data.error);
                 }
@@ -818,7 +1901,7 @@ html_template = '''
                 if (data.translated_text) {
                     const directionText = direction === 'en_to_tl' ? 'English to Tagalog' : 'Tagalog to English';
                     translationResult.innerHTML = `<strong>Translated (${directionText}):</strong> ${data.translated_text}`;
-                    fetchTranscriptions();
+                    syncTranscriptions();
                 } else if (data.error) {
                     translationResult.textContent = data.error;
                 }
@@ -839,9 +1922,13 @@ html_template = '''
             }
         }
 
-        // Download Transcriptions
+        // Download Transcriptions matching the current search
         function downloadTranscriptions() {
-            window.location.href = '/download_transcriptions';
+            const params = new URLSearchParams({ format: downloadFormat.value });
+            if (searchBar.value) {
+                params.set('search', searchBar.value);
+            }
+            window.location.href = '/download_transcriptions?' + params.toString();
         }
 
         // Close Modal when clicking outside of it
@@ -856,12 +1943,29 @@ html_template = '''
         }
 
         // Fetch existing transcriptions on page load
-        window.onload = fetchTranscriptions;
+        window.onload = () => {
+            fetchTranscriptions();
+            listenForChanges();
+        };
     </script>
 </body>
 </html>
 '''
 
+# Application factory for production servers (see wsgi.py and asgi.py). The
+# services above are created once per process when this module is imported;
+# the factory makes sure the schema is up to date and hands out the app.
+def create_app():
+    db.init_db()
+    maintenance.start()
+    return app
+
+# Stop the worker pools, letting queued transcriptions finish
+def shutdown():
+    job_queue.shutdown()
+    recognition_pool.shutdown()
+    writer.close()
+    maintenance.stop()
+
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import zlib
+
+import db
+
+# Archive of transcriptions moved out of the live table by the retention
+# policy. Rows (with their segments) are stored as zlib-compressed blocks of
+# JSON lines in a separate SQLite file, so they stay out of the hot table,
+# its indexes and its page cache, and take a fraction of the space. The
+# archive is searched on demand by decompressing the blocks that overlap the
+# requested time range.
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS archive_blocks (
+        id INTEGER PRIMARY KEY,
+        first_id INTEGER NOT NULL UNIQUE,
+        last_id INTEGER NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        row_count INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+'''
+# A block is keyed by its first row id: when a move is interrupted after the
+# block was written, the next run rewrites the same block instead of adding a
+# duplicate
+INSERT_BLOCK = '''
+    INSERT OR REPLACE INTO archive_blocks (first_id, last_id, start_time, end_time, row_count, data)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+SELECT_BLOCKS = '''
+    SELECT data FROM archive_blocks
+    WHERE end_time >= ? AND start_time < ?
+    ORDER BY last_id DESC
+'''
+SELECT_ALL_BLOCKS = 'SELECT data FROM archive_blocks'
+SELECT_ARCHIVE_STATS = 'SELECT COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM archive_blocks'
+
+SELECT_EXPIRED = f'''
+    SELECT {db.TRANSCRIPTION_COLUMNS} FROM transcriptions
+    WHERE timestamp < ? ORDER BY id LIMIT ?
+'''
+SELECT_SEGMENTS_BY_IDS = '''
+    SELECT transcription_id, idx AS "index", start_ms, end_ms, text FROM transcription_segments
+    WHERE transcription_id IN (SELECT value FROM json_each(?))
+    ORDER BY transcription_id, idx
+'''
+MARK_IMPORTS_ARCHIVED = '''
+    UPDATE import_progress SET archived = 1
+    WHERE transcription_id IN (SELECT value FROM json_each(?))
+'''
+
+# Sorts after every timestamp, as the open end of a range
+END_OF_TIME = '9999'
+
+
+def encode_block(rows):
+    return zlib.compress('\n'.join(json.dumps(row, ensure_ascii=False) for row in rows).encode(), 9)
+
+
+def decode_block(data):
+    for line in zlib.decompress(data).decode().split('\n'):
+        yield json.loads(line)
+
+
+class Archive:
+    def __init__(self, path='archive.db'):
+        self.path = path
+
+    def _connect(self, readonly=False):
+        if readonly:
+            return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(ARCHIVE_SCHEMA)
+        return conn
+
+    # Move transcriptions with a timestamp before cutoff into the archive,
+    # block_size rows per transaction. Each block is committed to the archive
+    # before its rows are deleted, while the live table's write lock is held.
+    # Returns (ids, change log version) for every block moved.
+    def archive_before(self, cutoff, block_size=1000):
+        moved = []
+        archive = self._connect()
+        try:
+            while True:
+                with db.transaction() as conn:
+                    rows = [dict(row) for row in conn.execute(SELECT_EXPIRED, (cutoff, block_size))]
+                    if not rows:
+                        break
+                    ids = [row['id'] for row in rows]
+                    segments = {}
+                    for segment in conn.execute(SELECT_SEGMENTS_BY_IDS, (json.dumps(ids),)):
+                        segment = dict(segment)
+                        segments.setdefault(segment.pop('transcription_id'), []).append(segment)
+                    for row in rows:
+                        row['segments'] = segments.get(row['id'], [])
+                    timestamps = [row['timestamp'] for row in rows]
+                    archive.execute(INSERT_BLOCK, (ids[0], ids[-1], min(timestamps), max(timestamps), len(rows),
+                                                   encode_block(rows)))
+                    conn.execute(MARK_IMPORTS_ARCHIVED, (json.dumps(ids),))
+                    conn.executemany(db.DELETE_TRANSCRIPTION, [(i,) for i in ids])
+                    version = conn.execute(db.SELECT_CHANGE_VERSION).fetchone()[0]
+                moved.append((ids, version))
+                if len(rows) < block_size:
+                    break
+        finally:
+            archive.close()
+        return moved
+
+    # Archived rows, newest first, whose text contains every word (case
+    # insensitively) and whose timestamp is in [start, end). Segments are
+    # left out.
+    def search(self, words=(), start=None, end=None, limit=50):
+        if not os.path.exists(self.path):
+            return []
+        words = [word.casefold() for word in words]
+        start, end = start or '', end or END_OF_TIME
+        results, seen = [], set()
+        conn = self._connect(readonly=True)
+        try:
+            for (data,) in conn.execute(SELECT_BLOCKS, (start, end)):
+                for row in reversed(list(decode_block(data))):
+                    if row['id'] in seen or not start <= row['timestamp'] < end:
+                        continue
+                    text = f"{row['transcription']} {row['translated_text'] or ''}".casefold()
+                    if all(word in text for word in words):
+                        seen.add(row['id'])
+                        row.pop('segments', None)
+                        results.append(row)
+                        if len(results) >= limit:
+                            return results
+        finally:
+            conn.close()
+        return results
+
+    # Hashes of the stored audio archived rows refer to
+    def upload_hashes(self):
+        if not os.path.exists(self.path):
+            return set()
+        conn = self._connect(readonly=True)
+        try:
+            return {row.get('upload_hash') for (data,) in conn.execute(SELECT_ALL_BLOCKS)
+                    for row in decode_block(data)} - {None}
+        finally:
+            conn.close()
+
+    def stats(self):
+        if not os.path.exists(self.path):
+            return {'blocks': 0, 'rows': 0, 'bytes': 0}
+        conn = self._connect(readonly=True)
+        try:
+            blocks, rows, size = conn.execute(SELECT_ARCHIVE_STATS).fetchone()
+        finally:
+            conn.close()
+        return {'blocks': blocks, 'rows': rows, 'bytes': size}
@@ -0,0 +1,13 @@
+# ASGI entry point for uvicorn and other ASGI servers (needs asgiref):
+#
+#     uvicorn asgi:application
+#
+# Flask views are synchronous, so asgiref runs each request on a worker
+# thread; the event loop itself only handles the connections. Keep to one
+# process: jobs, live sessions and event streams are held in its memory (see
+# gunicorn.conf.py).
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+application = WsgiToAsgi(create_app())
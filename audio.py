@@ -0,0 +1,434 @@
+import aifc
+import io
+import os
+import shutil
+import subprocess
+import wave
+from collections import deque
+
+import numpy as np
+import speech_recognition as sr
+from speech_recognition.audio import get_flac_converter
+
+# Audio helpers shared by the upload, live streaming and long-file pipelines.
+# Audio is handled as 16-bit little-endian mono PCM.
+
+SAMPLE_WIDTH = 2
+
+
+class UnsupportedAudioError(ValueError):
+    """Raised when an upload can't be decoded."""
+
+
+class AudioTooLongError(UnsupportedAudioError):
+    """Raised when a recording is longer than the allowed duration."""
+
+
+def check_duration(seconds, max_seconds):
+    if max_seconds and seconds > max_seconds:
+        raise AudioTooLongError(f'Recording is {seconds:.0f}s long; the limit is {max_seconds:.0f}s.')
+
+
+def pcm_to_samples(pcm):
+    return np.frombuffer(pcm, dtype='<i2')
+
+
+# Root-mean-square energy of each complete frame_length-sample frame,
+# computed chunk_frames frames at a time to bound the float64 copies
+def frame_energy(samples, frame_length, chunk_frames=4096):
+    frames = len(samples) // frame_length
+    energies = np.empty(frames)
+    for first in range(0, frames, chunk_frames):
+        last = min(frames, first + chunk_frames)
+        framed = samples[first * frame_length:last * frame_length].astype(np.float64).reshape(-1, frame_length)
+        energies[first:last] = np.sqrt(np.mean(framed * framed, axis=1))
+    return energies
+
+
+class Segment:
+    def __init__(self, index, start, samples, sample_rate):
+        self.index = index
+        self.start = start
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def end(self):
+        return self.start + len(self.samples)
+
+    @property
+    def start_ms(self):
+        return self.start * 1000 // self.sample_rate
+
+    @property
+    def end_ms(self):
+        return self.end * 1000 // self.sample_rate
+
+    @property
+    def pcm(self):
+        return self.samples.astype('<i2').tobytes()
+
+
+# Incremental energy-based segmenter. feed() takes PCM as it arrives and
+# returns the segments completed so far: a segment ends after min_silence_ms
+# of frames quieter than threshold, or when it reaches max_segment_ms.
+# Segments keep padding_ms of audio around the speech and are dropped when
+# they hold less than min_speech_ms of it.
+class SilenceSegmenter:
+    def __init__(self, sample_rate, threshold=500, frame_ms=30, min_silence_ms=500,
+                 max_segment_ms=15000, min_speech_ms=150, padding_ms=200):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.frame_length = max(1, sample_rate * frame_ms // 1000)
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.max_segment_frames = max(1, max_segment_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+
+        self._pending = np.empty(0, dtype=np.int16)
+        self._position = 0  # sample offset of the first pending sample
+        self._preroll = deque(maxlen=self.padding_frames)
+        self._frames = []
+        self._start = 0
+        self._speech_frames = 0
+        self._silent_run = 0
+        self._next_index = 0
+
+    def feed(self, pcm):
+        samples = np.concatenate((self._pending, pcm_to_samples(pcm)))
+        energies = frame_energy(samples, self.frame_length)
+        used = len(energies) * self.frame_length
+        self._pending = samples[used:]
+
+        segments = []
+        for i, energy in enumerate(energies):
+            frame = samples[i * self.frame_length:(i + 1) * self.frame_length]
+            frame_start = self._position + i * self.frame_length
+            segment = self._add_frame(frame, frame_start, energy >= self.threshold)
+            if segment is not None:
+                segments.append(segment)
+        self._position += used
+        return segments
+
+    # Close whatever is buffered, including a trailing partial frame
+    def flush(self):
+        if len(self._pending) and self._frames:
+            self._frames.append(self._pending)
+        self._position += len(self._pending)
+        self._pending = np.empty(0, dtype=np.int16)
+        segment = self._close(trim=False)
+        return [segment] if segment is not None else []
+
+    def _add_frame(self, frame, frame_start, voiced):
+        if not self._frames:
+            if not voiced:
+                self._preroll.append((frame_start, frame))
+                return None
+            preroll = list(self._preroll)
+            self._preroll.clear()
+            self._start = preroll[0][0] if preroll else frame_start
+            self._frames = [f for _, f in preroll]
+
+        self._frames.append(frame)
+        if voiced:
+            self._speech_frames += 1
+            self._silent_run = 0
+        else:
+            self._silent_run += 1
+
+        if self._silent_run >= self.min_silence_frames or len(self._frames) >= self.max_segment_frames:
+            return self._close(trim=True)
+        return None
+
+    def _close(self, trim):
+        frames, speech = self._frames, self._speech_frames
+        if trim:
+            # Keep only padding_frames of the trailing silence
+            excess = self._silent_run - self.padding_frames
+            if excess > 0:
+                frames = frames[:-excess]
+        self._frames = []
+        self._speech_frames = 0
+        self._silent_run = 0
+        if speech < self.min_speech_frames or not frames:
+            return None
+        segment = Segment(self._next_index, self._start, np.concatenate(frames), self.sample_rate)
+        self._next_index += 1
+        return segment
+
+
+# Split a complete recording into speech segments
+def split_on_silence(pcm, sample_rate, **options):
+    segmenter = SilenceSegmenter(sample_rate, **options)
+    return segmenter.feed(pcm) + segmenter.flush()
+
+
+# Identify an upload's container from its first bytes. Browsers label
+# MediaRecorder output inconsistently, so the declared type isn't trusted.
+def sniff_format(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return 'wav'
+    if data[:4] == b'FORM' and data[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+    if data[:4] == b'fLaC':
+        return 'flac'
+    if data[:4] == b'OggS':
+        return 'ogg'
+    if data[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if data[4:8] == b'ftyp':
+        return 'mp4'
+    if data[:3] == b'ID3' or (len(data) > 1 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return 'unknown'
+
+
+# Decode an open wave or aifc reader block by block to mono float samples in
+# [-1, 1], resampled to sample_rate, so only one block of the original is in
+# memory at a time. The duration in the header is checked before any audio is
+# read.
+def decode_frames(reader, sample_rate, max_seconds=None, block_frames=64 * 1024, big_endian=False):
+    channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+    check_duration(reader.getnframes() / rate, max_seconds)
+    resampler = Resampler(rate, sample_rate)
+    blocks = []
+    while True:
+        frames = reader.readframes(block_frames)
+        if not frames:
+            break
+        if big_endian:
+            frames = big_to_little_endian(frames, width)
+        blocks.append(resampler.feed(pcm_to_float(frames, width, channels)))
+    blocks.append(resampler.flush())
+    return np.concatenate(blocks)
+
+
+def decode_wav(file, sample_rate, max_seconds=None):
+    with wave.open(file, 'rb') as wav:
+        return decode_frames(wav, sample_rate, max_seconds)
+
+
+def decode_aiff(file, sample_rate, max_seconds=None):
+    file.seek(0)
+    try:
+        with aifc.open(file, 'rb') as aiff:
+            return decode_frames(aiff, sample_rate, max_seconds, big_endian=True)
+    except (aifc.Error, EOFError) as e:
+        raise UnsupportedAudioError(str(e))
+
+
+# AIFF samples are big-endian and signed at every width; WAV's (which
+# pcm_to_float reads) are little-endian, and unsigned at 8 bits
+def big_to_little_endian(frames, width):
+    data = np.frombuffer(frames, dtype=np.uint8)
+    if width == 1:
+        return (data ^ 0x80).tobytes()
+    return data[:len(data) // width * width].reshape(-1, width)[:, ::-1].tobytes()
+
+
+def pcm_to_float(frames, width, channels):
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16) << 8 >> 8).astype(np.float32) / 8388608
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise UnsupportedAudioError(f'Unsupported sample width: {width} bytes')
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+# Keyword arguments to subprocess.run feeding it the file from its current
+# position: files on disk are passed as stdin directly, anything else is read
+# into memory. A seek inside the read buffer doesn't move the descriptor, so
+# it is synced to the file's position first.
+def pipe_source(file):
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError):
+        return {'input': file.read()}
+    os.lseek(fd, file.tell(), os.SEEK_SET)
+    return {'stdin': file}
+
+
+# Duration of a FLAC file from its STREAMINFO block, which the format
+# requires to come first: 20 bits of sample rate and, after the channel count
+# and sample size, 36 bits of total samples. None when the header doesn't
+# say (a total of 0 means unknown).
+def flac_duration(file):
+    file.seek(0)
+    header = file.read(26)
+    file.seek(0)
+    if len(header) < 26 or header[:4] != b'fLaC' or header[4] & 0x7F != 0:
+        return None
+    fields = int.from_bytes(header[18:26], 'big')
+    rate, total = fields >> 44, fields & (1 << 36) - 1
+    return total / rate if rate and total else None
+
+
+# Convert FLAC to AIFF with the flac tool speech_recognition bundles, piping
+# the file to it as for ffmpeg. The whole recording is converted at once, so
+# the duration in its STREAMINFO block is checked first.
+def flac_to_aiff(file, max_seconds=None):
+    duration = flac_duration(file)
+    if duration is not None:
+        check_duration(duration, max_seconds)
+    try:
+        flac = get_flac_converter()
+    except OSError as e:
+        raise UnsupportedAudioError(str(e))
+    file.seek(0)
+    source = pipe_source(file)
+    result = subprocess.run([flac, '--stdout', '--totally-silent', '--decode', '--force-aiff-format', '-'],
+                            capture_output=True, **source)
+    if result.returncode != 0:
+        raise UnsupportedAudioError('Could not decode the FLAC file.')
+    return io.BytesIO(result.stdout)
+
+
+# Decode compressed browser formats (WebM/Opus, Ogg, MP4, MP3) with ffmpeg,
+# which resamples and downmixes on the way. Files on disk are piped to ffmpeg
+# directly rather than read into memory first, and with max_seconds ffmpeg
+# stops decoding just past the limit.
+def decode_with_ffmpeg(file, sample_rate, max_seconds=None):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise UnsupportedAudioError('Decoding this audio format requires ffmpeg.')
+    limit = ['-t', str(max_seconds + 1)] if max_seconds else []
+    source = pipe_source(file)
+    result = subprocess.run(
+        [ffmpeg, '-nostdin', '-loglevel', 'error', '-i', 'pipe:0', *limit,
+         '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+        capture_output=True, **source)
+    if result.returncode != 0:
+        raise UnsupportedAudioError(result.stderr.decode(errors='replace').strip() or 'ffmpeg failed.')
+    return pcm_to_float(result.stdout, SAMPLE_WIDTH, 1), sample_rate
+
+
+# Streaming resampler: linear interpolation, after a moving-average low-pass
+# filter when downsampling so high frequencies don't alias. feed() takes
+# consecutive blocks of float samples and returns the output they complete;
+# flush() returns the rest. The output is the same as resampling the whole
+# recording at once.
+class Resampler:
+    def __init__(self, rate, target_rate):
+        self.rate = rate
+        self.target_rate = target_rate
+        self.step = rate / target_rate
+        self.width = int(round(rate / target_rate)) if target_rate < rate else 1
+        self._kernel = np.full(self.width, 1 / self.width, dtype=np.float32)
+        # The filter is centred like np.convolve(mode='same'): each output
+        # needs (width - 1) // 2 samples that come after it
+        self._history = np.zeros(self.width - 1, dtype=np.float32)
+        self._lag = (self.width - 1) // 2
+        self._filtered = np.empty(0, dtype=np.float32)
+        self._offset = 0  # index of the first sample in _filtered
+        self._received = 0
+        self._next = 0  # index of the next output sample
+
+    def feed(self, samples):
+        self._received += len(samples)
+        if self.rate == self.target_rate:
+            return samples
+        return self._interpolate(self._lowpass(samples), final=False)
+
+    def flush(self):
+        if self.rate == self.target_rate:
+            return np.empty(0, dtype=np.float32)
+        # Trailing zeros stand in for the padding mode='same' adds at the end
+        filtered = self._lowpass(np.zeros(self.width // 2, dtype=np.float32))
+        return self._interpolate(filtered, final=True)
+
+    def _lowpass(self, samples):
+        if self.width == 1:
+            return samples
+        padded = np.concatenate((self._history, samples))
+        self._history = padded[len(padded) - (self.width - 1):]
+        filtered = np.convolve(padded, self._kernel, mode='valid') if len(padded) >= self.width else padded[:0]
+        skip = min(self._lag, len(filtered))
+        self._lag -= skip
+        return filtered[skip:]
+
+    def _interpolate(self, filtered, final):
+        samples = np.concatenate((self._filtered, filtered))
+        available = self._offset + len(samples)
+        end = int(self._received * self.target_rate / self.rate)
+        if not final:
+            # Only positions whose right-hand neighbour has arrived
+            end = max(self._next, min(end, int(np.ceil((available - 1) / self.step))))
+        positions = np.arange(self._next, end) * self.step
+        if not final:
+            positions = positions[:np.searchsorted(positions, available - 1)]
+        if not len(samples):
+            return np.zeros(len(positions), dtype=np.float32)
+        output = np.interp(positions, np.arange(self._offset, available), samples).astype(np.float32)
+        self._next += len(positions)
+        keep = min(int(self._next * self.step), available - 1) - self._offset
+        if keep > 0:
+            self._filtered, self._offset = samples[keep:], self._offset + keep
+        else:
+            self._filtered = samples
+        return output
+
+
+def resample(samples, rate, target_rate):
+    if rate == target_rate or not len(samples):
+        return samples
+    resampler = Resampler(rate, target_rate)
+    return np.concatenate((resampler.feed(samples), resampler.flush()))
+
+
+# Cut leading and trailing frames quieter than threshold (RMS on the 16-bit
+# scale), keeping padding_ms of audio around what is left. Returns the samples
+# kept and the index of the first one.
+def trim_silence(samples, sample_rate, threshold=500, frame_ms=30, padding_ms=200):
+    frame_length = max(1, sample_rate * frame_ms // 1000)
+    voiced = np.flatnonzero(frame_energy(samples, frame_length) >= threshold / 32768)
+    if not len(voiced):
+        return samples[:0], 0
+    padding = sample_rate * padding_ms // 1000
+    start = max(0, voiced[0] * frame_length - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_length + padding)
+    return samples[start:end], int(start)
+
+
+# Ingest stage run before recognition: sniff the container, decode it, mix
+# down to mono, resample to sample_rate and optionally trim silence. Takes
+# the audio as bytes or as a seekable binary file, which WAV and AIFF files
+# are decoded from in blocks. Recordings longer than max_seconds raise
+# AudioTooLongError.
+# Returns 16-bit mono sr.AudioData and the milliseconds of leading silence
+# trimmed off, which timings within the audio are offset by in the original.
+def normalize_audio(data, sample_rate=16000, trim=True, trim_threshold=500, max_seconds=None):
+    file = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    file.seek(0)
+    fmt = sniff_format(file.read(12))
+    file.seek(0)
+    if fmt == 'wav':
+        try:
+            samples = decode_wav(file, sample_rate, max_seconds)
+        except (wave.Error, EOFError) as e:
+            raise UnsupportedAudioError(str(e))
+    elif fmt == 'aiff':
+        samples = decode_aiff(file, sample_rate, max_seconds)
+    elif fmt == 'flac':
+        samples = decode_aiff(flac_to_aiff(file, max_seconds), sample_rate, max_seconds)
+    else:
+        samples, rate = decode_with_ffmpeg(file, sample_rate, max_seconds)
+        check_duration(len(samples) / rate, max_seconds)
+        samples = resample(samples, rate, sample_rate)
+
+    offset_ms = 0
+    if trim:
+        samples, start = trim_silence(samples, sample_rate, trim_threshold)
+        offset_ms = start * 1000 // sample_rate
+    # Scaled in place: the samples are ours and can be long
+    samples = np.clip(samples, -1, 1, out=samples)
+    samples *= 32767
+    pcm = samples.astype('<i2').tobytes()
+    return sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH), offset_ms
@@ -0,0 +1,96 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from audio import sniff_format
+
+# Content-addressed store of the original uploads. Files are named by the
+# SHA-256 of their bytes and sharded two directory levels deep by the first
+# hex digits (ab/cd/abcd...), so no directory grows too large and the same
+# recording uploaded twice is stored once. Rows point at their file through
+# transcriptions.upload_hash.
+
+HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+MIMETYPES = {
+    'wav': 'audio/wav',
+    'aiff': 'audio/aiff',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+    'webm': 'audio/webm',
+    'mp4': 'audio/mp4',
+    'mp3': 'audio/mpeg',
+}
+
+
+class AudioStore:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.root = 'audio'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['AUDIO_STORE']
+        self.root = app.config['AUDIO_STORE_DIR']
+        app.extensions['audio_store'] = self
+
+    def path(self, content_hash):
+        if not HASH_PATTERN.fullmatch(content_hash or ''):
+            raise ValueError(f'Invalid audio hash: {content_hash!r}')
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def exists(self, content_hash):
+        return os.path.exists(self.path(content_hash))
+
+    # Copy a seekable binary file into the store under its hash. The copy is
+    # written next to its final name and renamed into place, so readers never
+    # see a partial file. The file is left rewound.
+    def put(self, file, content_hash):
+        path = self.path(content_hash)
+        if os.path.exists(path):
+            return path
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        file.seek(0)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix='.tmp-', delete=False) as tmp:
+            try:
+                shutil.copyfileobj(file, tmp, 1024 * 1024)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        file.seek(0)
+        return path
+
+    def put_path(self, source, content_hash):
+        with open(source, 'rb') as f:
+            return self.put(f, content_hash)
+
+    def open(self, content_hash):
+        return open(self.path(content_hash), 'rb')
+
+    # Media type of a stored file, sniffed from its first bytes
+    def mimetype(self, content_hash):
+        with self.open(content_hash) as f:
+            return MIMETYPES.get(sniff_format(f.read(12)), 'application/octet-stream')
+
+    # Delete stored files that no row references any more. Files younger than
+    # grace seconds are kept: their row may not be committed yet.
+    def prune(self, referenced, grace=3600):
+        cutoff = time.time() - grace
+        removed = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name in referenced or not (HASH_PATTERN.fullmatch(name) or name.startswith('.tmp-')):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
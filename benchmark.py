@@ -0,0 +1,275 @@
+"""Benchmark the HTTP routes and the database layer.
+
+Builds a database of generated transcriptions, runs each scenario through
+Flask's test client with the stub recognizer and the fake translator, and
+writes p50/p95/p99 latency, throughput and peak RSS per scenario to a JSON
+file. Pass a previous results file with --compare to fail on regressions.
+
+    python benchmark.py --rows 100000 --output bench.json
+    python benchmark.py --rows 100000 --compare bench.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WORDS = (
+    'the a meeting call customer order delivery invoice payment refund account password schedule monday '
+    'tuesday friday morning afternoon please thank you hello goodbye yes no maybe today tomorrow week '
+    'manila office team project report update question answer problem issue ticket support phone email '
+    'address number price total discount weather traffic lunch dinner family school doctor appointment'
+).split()
+
+SCENARIOS = ('transcribe', 'translate', 'list', 'search', 'edit', 'delete', 'download')
+
+# Full exports are orders of magnitude slower than the other routes, so they
+# run this many times fewer iterations
+DOWNLOAD_DIVISOR = 20
+
+
+def generated_sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 25)))
+
+
+# Fill the transcriptions table with reproducible rows spread over a year
+def populate(db, rows, seed, chunk_size=10000):
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    with db.transaction() as conn:
+        for offset in range(0, rows, chunk_size):
+            conn.executemany(
+                'INSERT INTO transcriptions (transcription, timestamp) VALUES (?, ?)',
+                [(generated_sentence(rng), (start + datetime.timedelta(seconds=rng.randrange(366 * 86400)))
+                  .strftime('%Y-%m-%d %H:%M:%S'))
+                 for _ in range(min(chunk_size, rows - offset))])
+    db.connection().execute('ANALYZE')
+
+
+# One second of noise, different for every seed so the recognition cache
+# never answers for the recognizer
+def noise_wav(seed, rate=16000):
+    samples = (np.random.default_rng(seed).standard_normal(rate) * 3000).astype('<i2')
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Bench:
+    def __init__(self, app, rows, seed):
+        self.app = app
+        self.rows = rows
+        self.seed = seed
+        self._local = threading.local()
+        self._counter = iter(range(sys.maxsize))
+        self._lock = threading.Lock()
+        # Deletes take ids from the end of the table so the other scenarios
+        # keep finding their rows
+        self._delete_ids = iter(range(rows, 0, -1))
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def _next(self):
+        with self._lock:
+            return next(self._counter)
+
+    def _random_id(self, n):
+        return random.Random(self.seed * 1000003 + n).randint(1, max(1, self.rows // 2))
+
+    def transcribe(self, n):
+        return self.client.post('/transcribe', data={'audio_data': (io.BytesIO(noise_wav(self.seed + n)), 'b.wav')})
+
+    def translate(self, n):
+        direction = 'en_to_tl' if n % 2 else 'tl_to_en'
+        return self.client.post(f'/translate/{self._random_id(n)}', json={'direction': direction})
+
+    def list(self, n):
+        return self.client.get('/get_transcriptions')
+
+    def search(self, n):
+        word = random.Random(self.seed + n).choice(WORDS)
+        return self.client.get(f'/get_transcriptions?search={word}')
+
+    def edit(self, n):
+        text = generated_sentence(random.Random(self.seed + n))
+        return self.client.put(f'/edit_transcription/{self._random_id(n)}', json={'transcription': text})
+
+    def delete(self, n):
+        with self._lock:
+            transcription_id = next(self._delete_ids)
+        return self.client.delete(f'/delete_transcription/{transcription_id}')
+
+    def download(self, n):
+        response = self.client.get('/download_transcriptions?format=csv')
+        for _ in response.response:
+            pass
+        return response
+
+    def run(self, scenario, requests, concurrency, warmup):
+        call = getattr(self, scenario)
+        for _ in range(warmup):
+            call(self._next())
+
+        def timed(_):
+            n = self._next()
+            started = time.perf_counter()
+            response = call(n)
+            elapsed = time.perf_counter() - started
+            return elapsed, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, range(requests)))
+        wall = time.perf_counter() - started
+
+        latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+        return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'errors': sum(1 for _, status in results if status >= 400),
+            'throughput_rps': requests / wall if wall else 0.0,
+            'mean_ms': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Scenarios whose p95 latency grew, or throughput fell, by more than threshold
+def regressions(baseline, current, threshold):
+    found = []
+    for scenario, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if before is None:
+            continue
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            found.append(f"{scenario}: p95 {before['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms")
+        if before['throughput_rps'] and result['throughput_rps'] < before['throughput_rps'] / (1 + threshold):
+            found.append(f"{scenario}: throughput {before['throughput_rps']:.1f}/s -> {result['throughput_rps']:.1f}/s")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='Generated transcriptions (default: 10000).')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario (default: 200).')
+    parser.add_argument('--concurrency', type=int, default=1, help='Concurrent clients (default: 1).')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario (default: 5).')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database', help='Reuse this database instead of generating a temporary one.')
+    parser.add_argument('--recognizer-latency', type=float, default=0.0, help='Seconds the stub recognizer sleeps.')
+    parser.add_argument('--translator-latency', type=float, default=0.0, help='Seconds the fake translator sleeps.')
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to write the results.')
+    parser.add_argument('--compare', help='Previous results file; exit with status 1 on regressions.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown for --compare (default: 0.2).')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'benchmark.db')
+    generate = not os.path.exists(database)
+    # The app reads its configuration at import time. Uploads are stored next
+    # to the database, not in the working tree's audio store.
+    os.environ.update({
+        'DATABASE': database,
+        'AUDIO_STORE_DIR': os.path.join(os.path.dirname(os.path.abspath(database)), 'audio'),
+        'RECOGNIZER_BACKEND': 'stub',
+        'STUB_RECOGNIZER_LATENCY': str(args.recognizer_latency),
+        'TRANSLATOR_BACKEND': 'fake',
+        'FAKE_TRANSLATOR_LATENCY': str(args.translator_latency),
+        'TRANSLATOR_RATE_LIMIT': '0',
+    })
+    import app as application
+    import db
+
+    db.init_db()
+    with application.app.app_context():
+        if generate:
+            started = time.perf_counter()
+            populate(db, args.rows, args.seed)
+            print(f'Generated {args.rows} rows in {time.perf_counter() - started:.1f}s')
+        rows = db.query_one('SELECT COUNT(*) AS count FROM transcriptions')['count']
+
+    bench = Bench(application.app, rows, args.seed)
+    results = {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rows': rows,
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        requests = args.requests
+        if scenario == 'download':
+            requests = max(3, requests // DOWNLOAD_DIVISOR)
+        if scenario == 'delete':
+            requests = min(requests, rows - args.warmup)
+        result = bench.run(scenario, requests, args.concurrency, args.warmup)
+        results['scenarios'][scenario] = result
+        print(f"{scenario:<10} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+              f"p99 {result['p99_ms']:8.2f}ms  {result['throughput_rps']:8.1f} req/s  "
+              f"{result['errors']} errors  rss {result['peak_rss_mb']:.0f}MB")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            found = regressions(json.load(f), results, args.threshold)
+        for line in found:
+            print(f'REGRESSION {line}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+
+# Thread-safe in-memory LRU cache with an optional time-to-live (seconds).
+# Keeps hit/miss/eviction counters for the stats endpoints.
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+# Two-tier cache: an in-memory LRU in front of a database table, which
+# survives restarts and is shared by every worker process. Entries older than
+# ttl seconds are ignored in both tiers. Subclasses name their settings and
+# table statements:
+#   - name: the app.extensions key; its upper case prefixes the _SIZE and
+#     _TTL settings
+#   - select_sql: takes the key's values followed by the oldest accepted
+#     created_at
+#   - upsert_sql: takes the row built by to_row
+#   - purge_sql: deletes the rows created at or before the given time
+# and convert between rows and cached values with from_row and to_row.
+# Expired rows are skipped on lookup and deleted by purge_expired, which the
+# maintenance task runs.
+class TwoTierCache:
+    name = None
+    select_sql = None
+    upsert_sql = None
+    purge_sql = None
+
+    def __init__(self, app=None):
+        self.memory = LRUCache()
+        self.ttl = None
+        self.persistent_hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.name.upper()
+        self.ttl = app.config[f'{prefix}_TTL'] or None
+        self.memory = LRUCache(app.config[f'{prefix}_SIZE'], self.ttl)
+        app.extensions[self.name] = self
+
+    def from_row(self, row):
+        raise NotImplementedError
+
+    def to_row(self, key, value, created_at):
+        raise NotImplementedError
+
+    def lookup(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        oldest = time.time() - self.ttl if self.ttl else 0
+        row = db.query_one(self.select_sql, (*key, oldest))
+        if row is None:
+            self.misses += 1
+            return None
+        self.persistent_hits += 1
+        value = self.from_row(row)
+        self.memory.put(key, value)
+        return value
+
+    # Store several (key, value) pairs in a single transaction
+    def store(self, items):
+        now = time.time()
+        rows = []
+        for key, value in items:
+            self.memory.put(key, value)
+            rows.append(self.to_row(key, value, now))
+        with db.transaction() as conn:
+            conn.executemany(self.upsert_sql, rows)
+
+    # Delete persistent entries older than ttl; returns how many there were
+    def purge_expired(self):
+        if not self.ttl:
+            return 0
+        with db.transaction() as conn:
+            return conn.execute(self.purge_sql, (time.time() - self.ttl,)).rowcount
+
+    def stats(self):
+        memory = self.memory.stats()
+        hits = memory['hits'] + self.persistent_hits
+        lookups = hits + self.misses
+        return {
+            'memory': memory,
+            'persistent_hits': self.persistent_hits,
+            'hits': hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+        }
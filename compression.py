@@ -0,0 +1,77 @@
+import gzip
+
+from flask import request
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/csv', 'text/css', 'application/json',
+                      'application/javascript', 'text/javascript')
+
+
+def compress(data, encoding, level=6):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+# Compress responses when the client accepts it: brotli when the brotli
+# package is installed and the client asks for it, gzip otherwise. Only
+# complete (non-streamed) bodies of at least min_size bytes are compressed;
+# streamed responses such as exports and event streams are left alone.
+# Bodies with a strong ETag always compress to the same bytes, so those are
+# cached and compressed only once.
+class Compression:
+    def __init__(self, app=None):
+        self.min_size = 1024
+        self.level = 6
+        self.cache = LRUCache(64)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        app.after_request(self._after_request)
+        app.extensions['compression'] = self
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _after_request(self, response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (etag, encoding) if etag and not weak else None
+        body = self.cache.get(key) if key else None
+        if body is None:
+            body = compress(response.get_data(), encoding, self.level)
+            if key:
+                self.cache.put(key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # Like nginx, downgrade the entity tag to a weak one: the compressed
+        # body is no longer byte-for-byte what it names, but If-None-Match
+        # still matches it
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
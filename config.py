@@ -0,0 +1,142 @@
+import os
+
+# Application settings. Every value can be overridden through an environment
+# variable of the same name.
+class Config:
+    DATABASE = os.environ.get('DATABASE', 'database.db')
+
+    # Asynchronous transcription jobs
+    JOB_EXECUTOR = os.environ.get('JOB_EXECUTOR', 'thread')  # 'thread' or 'process'
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+    JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', 1000))
+    JOB_MAX_WAIT = float(os.environ.get('JOB_MAX_WAIT', 30))
+
+    # Speech recognition backend: 'google', 'sphinx', 'vosk' or 'stub'
+    RECOGNIZER_BACKEND = os.environ.get('RECOGNIZER_BACKEND', 'google')
+    RECOGNIZER_LANGUAGE = os.environ.get('RECOGNIZER_LANGUAGE', 'en-US')
+    GOOGLE_SPEECH_API_KEY = os.environ.get('GOOGLE_SPEECH_API_KEY')
+    VOSK_MODEL_PATH = os.environ.get('VOSK_MODEL_PATH', 'model')
+    STUB_RECOGNIZER_LATENCY = float(os.environ.get('STUB_RECOGNIZER_LATENCY', 0))
+    STUB_RECOGNIZER_TEXT = os.environ.get('STUB_RECOGNIZER_TEXT')
+
+    # SQLite connection pool and pragmas
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))  # negative = KiB
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+
+    # /get_transcriptions page sizes
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+    # Translation cache: in-memory LRU entries and time-to-live in seconds
+    # (0 keeps translations forever)
+    TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', 10000))
+    TRANSLATION_CACHE_TTL = float(os.environ.get('TRANSLATION_CACHE_TTL', 7 * 24 * 3600))
+
+    # /translate/batch limits
+    TRANSLATE_BATCH_MAX_IDS = int(os.environ.get('TRANSLATE_BATCH_MAX_IDS', 1000))
+    TRANSLATE_BATCH_CHUNK_SIZE = int(os.environ.get('TRANSLATE_BATCH_CHUNK_SIZE', 50))
+
+    # Add a Server-Timing header with the per-stage breakdown to every response
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') not in ('0', 'false', 'False')
+
+    # Seconds browsers may reuse the index page before revalidating it
+    INDEX_MAX_AGE = int(os.environ.get('INDEX_MAX_AGE', 3600))
+
+    # gzip/brotli compression of response bodies of at least COMPRESS_MIN_SIZE bytes
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+    # Bulk delete/edit/clear-translation requests
+    BULK_MAX_IDS = int(os.environ.get('BULK_MAX_IDS', 10000))
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
+    # Group commit: new transcriptions and translations are written by one
+    # writer thread, which commits everything queued within
+    # WRITE_GROUP_WAIT_MS (at most WRITE_GROUP_SIZE writes) together
+    WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '1') not in ('0', 'false', 'False')
+    WRITE_GROUP_SIZE = int(os.environ.get('WRITE_GROUP_SIZE', 64))
+    WRITE_GROUP_WAIT_MS = float(os.environ.get('WRITE_GROUP_WAIT_MS', 2))
+
+    # Retention: a background task moves transcriptions older than
+    # RETENTION_DAYS (0 keeps everything) into the compressed archive in
+    # ARCHIVE_DATABASE, ARCHIVE_BLOCK_SIZE rows per block. Every
+    # MAINTENANCE_INTERVAL seconds (0 disables the task) it also frees up to
+    # VACUUM_PAGES free pages and refreshes the query planner's statistics,
+    # sampling ANALYSIS_LIMIT rows per index. Only the server process holding
+    # a lock on MAINTENANCE_LOCK runs the task.
+    RETENTION_DAYS = float(os.environ.get('RETENTION_DAYS', 0))
+    ARCHIVE_DATABASE = os.environ.get('ARCHIVE_DATABASE', 'archive.db')
+    ARCHIVE_BLOCK_SIZE = int(os.environ.get('ARCHIVE_BLOCK_SIZE', 1000))
+    MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', 3600))
+    MAINTENANCE_LOCK = os.environ.get('MAINTENANCE_LOCK', f'{DATABASE}.maintenance.lock')
+    VACUUM_PAGES = int(os.environ.get('VACUUM_PAGES', 1000))
+    ANALYSIS_LIMIT = int(os.environ.get('ANALYSIS_LIMIT', 1000))
+
+    # Rows fetched per round trip while streaming /download_transcriptions
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 500))
+
+    # Upload limits: request bodies over MAX_CONTENT_LENGTH bytes are refused
+    # before they are read, recordings over MAX_AUDIO_SECONDS (0 for no
+    # limit) before they are decoded. Uploaded files over UPLOAD_SPOOL_SIZE
+    # bytes are spooled to disk instead of kept in memory.
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 50 * 1024 * 1024))
+    MAX_AUDIO_SECONDS = float(os.environ.get('MAX_AUDIO_SECONDS', 30 * 60))
+    UPLOAD_SPOOL_SIZE = int(os.environ.get('UPLOAD_SPOOL_SIZE', 1024 * 1024))
+
+    # Original uploads are kept in a content-addressed store under
+    # AUDIO_STORE_DIR for playback and re-transcription (AUDIO_STORE=0 to
+    # discard them), and served with a max-age of AUDIO_MAX_AGE seconds
+    AUDIO_STORE = os.environ.get('AUDIO_STORE', '1') not in ('0', 'false', 'False')
+    AUDIO_STORE_DIR = os.environ.get('AUDIO_STORE_DIR', 'audio')
+    AUDIO_MAX_AGE = int(os.environ.get('AUDIO_MAX_AGE', 365 * 24 * 3600))
+    # Let a front-end server that supports X-Sendfile send stored audio
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') not in ('0', 'false', 'False')
+
+    # Audio ingest: uploads are decoded, mixed down to mono, resampled to
+    # AUDIO_SAMPLE_RATE and, optionally, trimmed of leading/trailing silence
+    AUDIO_SAMPLE_RATE = int(os.environ.get('AUDIO_SAMPLE_RATE', 16000))
+    AUDIO_TRIM_SILENCE = os.environ.get('AUDIO_TRIM_SILENCE', '1') not in ('0', 'false', 'False')
+
+    # Recognition results cached by audio hash and engine settings; with
+    # RECOGNITION_DEDUPE, re-uploads of the same audio reuse the stored row
+    RECOGNITION_CACHE_SIZE = int(os.environ.get('RECOGNITION_CACHE_SIZE', 1000))
+    RECOGNITION_CACHE_TTL = float(os.environ.get('RECOGNITION_CACHE_TTL', 30 * 24 * 3600))
+    RECOGNITION_DEDUPE = os.environ.get('RECOGNITION_DEDUPE', '0') not in ('0', 'false', 'False')
+
+    # Per-segment speech recognition (live streaming and long uploads).
+    # Uploads longer than LONG_AUDIO_MS are split on silence.
+    RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', 8))
+    LONG_AUDIO_MS = int(os.environ.get('LONG_AUDIO_MS', 30000))
+    SEGMENT_SILENCE_THRESHOLD = int(os.environ.get('SEGMENT_SILENCE_THRESHOLD', 500))  # RMS of 16-bit samples
+    SEGMENT_MIN_SILENCE_MS = int(os.environ.get('SEGMENT_MIN_SILENCE_MS', 500))
+    SEGMENT_MAX_MS = int(os.environ.get('SEGMENT_MAX_MS', 15000))
+    STREAM_SESSION_TTL = float(os.environ.get('STREAM_SESSION_TTL', 300))
+    STREAM_MAX_SESSIONS = int(os.environ.get('STREAM_MAX_SESSIONS', 100))
+    STREAM_FINISH_TIMEOUT = float(os.environ.get('STREAM_FINISH_TIMEOUT', 60))
+
+    # Server-Sent Events
+    EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 256))
+    SSE_KEEPALIVE = float(os.environ.get('SSE_KEEPALIVE', 15))
+    # Open event streams (/events and /stream/<id>/events) allowed at once;
+    # more get 503 with a Retry-After of SSE_RETRY_AFTER seconds. Under the
+    # gthread worker each stream holds a thread, so keep this below
+    # GUNICORN_THREADS to leave threads for ordinary requests.
+    SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 48))
+    SSE_RETRY_AFTER = int(os.environ.get('SSE_RETRY_AFTER', 30))
+
+    # Translation service client pool: 'google' or 'fake'
+    TRANSLATOR_BACKEND = os.environ.get('TRANSLATOR_BACKEND', 'google')
+    TRANSLATOR_POOL_SIZE = int(os.environ.get('TRANSLATOR_POOL_SIZE', 4))
+    TRANSLATOR_TIMEOUT = float(os.environ.get('TRANSLATOR_TIMEOUT', 10))
+    TRANSLATOR_RATE_LIMIT = float(os.environ.get('TRANSLATOR_RATE_LIMIT', 5))  # calls per second, 0 = unlimited
+    TRANSLATOR_BURST = int(os.environ.get('TRANSLATOR_BURST', 10))
+    TRANSLATOR_MAX_RETRIES = int(os.environ.get('TRANSLATOR_MAX_RETRIES', 2))
+    TRANSLATOR_RETRY_BACKOFF = float(os.environ.get('TRANSLATOR_RETRY_BACKOFF', 0.5))
+    TRANSLATOR_BREAKER_THRESHOLD = int(os.environ.get('TRANSLATOR_BREAKER_THRESHOLD', 5))
+    TRANSLATOR_BREAKER_RESET = float(os.environ.get('TRANSLATOR_BREAKER_RESET', 30))
+    FAKE_TRANSLATOR_LATENCY = float(os.environ.get('FAKE_TRANSLATOR_LATENCY', 0))
+    FAKE_TRANSLATOR_FAILURE_RATE = float(os.environ.get('FAKE_TRANSLATOR_FAILURE_RATE', 0))
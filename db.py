@@ -0,0 +1,453 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from metrics import stage
+
+# Shared SQLite data layer.
+#
+# Connections are opened once with tuned pragmas and handed out from a pool:
+# each thread checks one out the first time it needs it and keeps it until
+# release() puts it back (Flask does this when the app context tears down).
+# Connections run in autocommit mode, so reads never hold a transaction open;
+# writes go through transaction(). sqlite3 keeps a per-connection cache of
+# compiled statements keyed by SQL text, so queries are written as module
+# constants and reused verbatim.
+
+TRANSCRIPTION_FIELDS = ('id', 'transcription', 'translated_text', 'translation_direction', 'timestamp', 'upload_hash')
+TRANSCRIPTION_COLUMNS = ', '.join(TRANSCRIPTION_FIELDS)
+
+SELECT_TRANSCRIPTION = f'SELECT {TRANSCRIPTION_COLUMNS} FROM transcriptions WHERE id = ?'
+INSERT_TRANSCRIPTION = 'INSERT INTO transcriptions (transcription, audio_hash, upload_hash) VALUES (?, ?, ?)'
+SELECT_CHANGE_VERSION = 'SELECT COALESCE(MAX(version), 0) FROM transcription_changes'
+SELECT_CHANGE_VERSIONS = 'SELECT COALESCE(MAX(version), 0), COALESCE(MIN(version), 0) FROM transcription_changes'
+SELECT_TRANSCRIPTION_BY_AUDIO_HASH = f'SELECT {TRANSCRIPTION_COLUMNS} FROM transcriptions WHERE audio_hash = ? ORDER BY id LIMIT 1'
+UPDATE_TRANSLATION = '''
+    UPDATE transcriptions
+    SET translated_text = ?, translation_direction = ?
+    WHERE id = ?
+'''
+# The row as written, or nothing when it no longer exists
+UPDATE_TRANSLATION_RETURNING = f'''
+    UPDATE transcriptions
+    SET translated_text = ?, translation_direction = ?
+    WHERE id = ?
+    RETURNING {TRANSCRIPTION_COLUMNS}
+'''
+UPDATE_TRANSCRIPTION = '''
+    UPDATE transcriptions
+    SET transcription = ?, translated_text = NULL, translation_direction = NULL, timestamp = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+# Replace the text with a new recognition of the row's stored audio
+UPDATE_RECOGNITION = '''
+    UPDATE transcriptions
+    SET transcription = ?, audio_hash = ?, translated_text = NULL, translation_direction = NULL
+    WHERE id = ?
+'''
+DELETE_TRANSCRIPTION = 'DELETE FROM transcriptions WHERE id = ?'
+SELECT_UPLOAD_HASHES = 'SELECT DISTINCT upload_hash FROM transcriptions WHERE upload_hash IS NOT NULL'
+INSERT_SEGMENT = '''
+    INSERT INTO transcription_segments (transcription_id, idx, start_ms, end_ms, text)
+    VALUES (?, ?, ?, ?, ?)
+'''
+DELETE_SEGMENTS = 'DELETE FROM transcription_segments WHERE transcription_id = ?'
+SELECT_SEGMENTS = '''
+    SELECT idx AS "index", start_ms, end_ms, text FROM transcription_segments
+    WHERE transcription_id = ? ORDER BY idx
+'''
+# Look up many rows at once; the ids are passed as one JSON array parameter
+SELECT_EXISTING_IDS = 'SELECT id FROM transcriptions WHERE id IN (SELECT value FROM json_each(?))'
+CLEAR_TRANSLATION = 'UPDATE transcriptions SET translated_text = NULL, translation_direction = NULL WHERE id = ?'
+SELECT_TRANSCRIPTIONS_BY_IDS = f'''
+    SELECT {TRANSCRIPTION_COLUMNS} FROM transcriptions
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+
+class ConnectionPool:
+    def __init__(self, path='database.db', size=8, cache_size=-20000, mmap_size=268435456,
+                 synchronous='NORMAL', busy_timeout=5000, statement_cache=128):
+        self.path = path
+        self.size = size
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.statement_cache = statement_cache
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=self.statement_cache)
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new database, and has to come before WAL
+        # mode is set; older databases are converted by a full VACUUM
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA foreign_keys = ON')
+        return conn
+
+    # The calling thread's connection, checked out from the pool if needed
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # Return the calling thread's connection to the pool
+    def release(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+pool = ConnectionPool()
+
+
+def init_app(app):
+    global pool
+    pool.close_all()
+    pool = ConnectionPool(
+        path=app.config['DATABASE'],
+        size=app.config['SQLITE_POOL_SIZE'],
+        cache_size=app.config['SQLITE_CACHE_SIZE'],
+        mmap_size=app.config['SQLITE_MMAP_SIZE'],
+        synchronous=app.config['SQLITE_SYNCHRONOUS'],
+        busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+    )
+    app.teardown_appcontext(lambda exc: pool.release())
+
+
+def connection():
+    return pool.connection()
+
+
+def query(sql, params=()):
+    with stage('db'):
+        return connection().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    with stage('db'):
+        return connection().execute(sql, params).fetchone()
+
+
+# Run a block of writes as one IMMEDIATE transaction, so the write lock is
+# taken up front instead of failing halfway with "database is locked"
+@contextmanager
+def transaction():
+    conn = connection()
+    with stage('db'):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+# One page of transcriptions, newest first, continuing after the
+# (timestamp, id) key of the previous page's last row. id and timestamp are
+# always selected because the next page's key is built from them.
+def list_transcriptions(fields, limit, after=None):
+    columns = ', '.join(dict.fromkeys(('id', 'timestamp') + tuple(fields)))
+    if after is None:
+        return query(f'''
+            SELECT {columns} FROM transcriptions
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', (limit,))
+    return query(f'''
+        SELECT {columns} FROM transcriptions
+        WHERE (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''', (*after, limit))
+
+
+# Transcriptions changed after version `since`, one row per transcription:
+# its current columns (NULL once deleted), whether it was inserted since then
+# and whether it is gone. At most limit rows are returned.
+def list_changes(since, fields, limit):
+    columns = ', '.join(f't.{field}' for field in dict.fromkeys(fields) if field != 'id')
+    return query(f'''
+        SELECT c.transcription_id AS id, c.inserted, t.id IS NULL AS deleted{', ' + columns if columns else ''}
+        FROM (
+            SELECT transcription_id, MAX(op = 'insert') AS inserted FROM transcription_changes
+            WHERE version > ? GROUP BY transcription_id ORDER BY MAX(version) LIMIT ?
+        ) c
+        LEFT JOIN transcriptions t ON t.id = c.transcription_id
+    ''', (since, limit))
+
+
+# One page of full-text search results over both text columns, best matches
+# first, continuing after the (rank, id) key of the previous page's last row.
+# bm25 ranks depend on the whole corpus, so when rows are added, edited or
+# deleted between pages the ranks shift and a later page may skip or repeat
+# a row: search paging is best-effort, unlike the (timestamp, id) paging of
+# list_transcriptions. Snippets wrap matches in \x02/\x03 so callers can
+# escape the text before adding markup.
+def search_transcriptions(match, fields, limit, after=None):
+    columns = ', '.join(f't.{field}' for field in dict.fromkeys(('id',) + tuple(fields)))
+    sql = f'''
+        SELECT {columns}, transcriptions_fts.rank AS rank,
+               snippet(transcriptions_fts, 0, char(2), char(3), '…', 64) AS transcription_snippet,
+               snippet(transcriptions_fts, 1, char(2), char(3), '…', 64) AS translated_snippet
+        FROM transcriptions_fts
+        JOIN transcriptions t ON t.id = transcriptions_fts.rowid
+        WHERE transcriptions_fts MATCH ?
+    '''
+    if after is None:
+        return query(sql + ' ORDER BY rank, t.id LIMIT ?', (match, limit))
+    return query(sql + ' AND (rank, t.id) > (?, ?) ORDER BY rank, t.id LIMIT ?', (match, *after, limit))
+
+
+# WHERE clause and parameters selecting transcriptions by timestamp (start
+# inclusive, end exclusive) and an FTS5 query; any of them may be None
+def transcription_filter(start=None, end=None, match=None):
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('timestamp < ?')
+        params.append(end)
+    if match is not None:
+        conditions.append('id IN (SELECT rowid FROM transcriptions_fts WHERE transcriptions_fts MATCH ?)')
+        params.append(match)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return where, params
+
+
+# Stream every transcription matching the optional filters (see
+# transcription_filter), newest first, fetching chunk_size rows at a time so
+# memory use stays flat however large the table is.
+def iter_transcriptions(start=None, end=None, match=None, chunk_size=500):
+    where, params = transcription_filter(start, end, match)
+    cursor = connection().execute(
+        f'SELECT {TRANSCRIPTION_COLUMNS} FROM transcriptions{where} ORDER BY timestamp DESC, id DESC',
+        params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+# Ids of the transcriptions matching the filters (at most limit of them), read
+# on conn so the caller can act on them in the same transaction
+def matching_ids(conn, start=None, end=None, match=None, limit=-1):
+    where, params = transcription_filter(start, end, match)
+    return [row[0] for row in conn.execute(f'SELECT id FROM transcriptions{where} ORDER BY id LIMIT ?', (*params, limit))]
+
+
+# executemany in chunks of chunk_size parameter sets; returns the number of
+# rows changed
+def executemany_chunked(conn, sql, params, chunk_size=500):
+    changed = 0
+    for start in range(0, len(params), chunk_size):
+        changed += conn.executemany(sql, params[start:start + chunk_size]).rowcount
+    return changed
+
+
+# Turn free text typed into the search bar into an FTS5 query: every word
+# must match, and the last one is treated as a prefix so results update while
+# the user is still typing. Returns None when there is nothing to search for.
+def fts_query(text):
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+# Schema migrations, applied in order on top of the original transcriptions
+# table. PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    # 1: full-text index kept in sync with transcriptions by triggers
+    (
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS transcriptions_fts USING fts5(
+            transcription, translated_text,
+            content='transcriptions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+            INSERT INTO transcriptions_fts (rowid, transcription, translated_text)
+            VALUES (new.id, new.transcription, new.translated_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_fts_delete AFTER DELETE ON transcriptions BEGIN
+            INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcription, translated_text)
+            VALUES ('delete', old.id, old.transcription, old.translated_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_fts_update
+        AFTER UPDATE OF transcription, translated_text ON transcriptions BEGIN
+            INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcription, translated_text)
+            VALUES ('delete', old.id, old.transcription, old.translated_text);
+            INSERT INTO transcriptions_fts (rowid, transcription, translated_text)
+            VALUES (new.id, new.transcription, new.translated_text);
+        END
+        ''',
+        "INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')",
+    ),
+    # 2: index backing keyset pagination on (timestamp, id)
+    (
+        'CREATE INDEX IF NOT EXISTS idx_transcriptions_timestamp ON transcriptions (timestamp)',
+    ),
+    # 3: persistent tier of the translation cache
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            src TEXT NOT NULL,
+            dest TEXT NOT NULL,
+            text TEXT NOT NULL,
+            translated_text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (src, dest, text)
+        ) WITHOUT ROWID
+        ''',
+    ),
+    # 4: per-segment timings of transcriptions recognized in pieces
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS transcription_segments (
+            transcription_id INTEGER NOT NULL REFERENCES transcriptions (id) ON DELETE CASCADE,
+            idx INTEGER NOT NULL,
+            start_ms INTEGER NOT NULL,
+            end_ms INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (transcription_id, idx)
+        ) WITHOUT ROWID
+        ''',
+    ),
+    # 5: content-addressed recognition results, keyed by the hash of the raw
+    # upload or of the normalized audio plus the engine settings
+    (
+        'ALTER TABLE transcriptions ADD COLUMN audio_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_transcriptions_audio_hash ON transcriptions (audio_hash)',
+        '''
+        CREATE TABLE IF NOT EXISTS recognition_cache (
+            content_hash TEXT NOT NULL,
+            engine TEXT NOT NULL,
+            transcription TEXT NOT NULL,
+            segments TEXT NOT NULL,
+            audio_hash TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (content_hash, engine)
+        ) WITHOUT ROWID
+        ''',
+    ),
+    # 6: checkpoints of the offline bulk importer (see importer.py)
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS import_progress (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            transcription_id INTEGER REFERENCES transcriptions (id) ON DELETE SET NULL,
+            error TEXT,
+            imported_at REAL NOT NULL
+        )
+        ''',
+    ),
+    # 7: change log for incremental list sync. Every insert, update and
+    # delete of a transcription gets a new version; once every 1000 versions
+    # entries more than 100000 versions old are pruned.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS transcription_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            transcription_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_transcription_changes_id ON transcription_changes (transcription_id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_log_insert AFTER INSERT ON transcriptions BEGIN
+            INSERT INTO transcription_changes (transcription_id, op) VALUES (new.id, 'insert');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_log_update AFTER UPDATE ON transcriptions BEGIN
+            INSERT INTO transcription_changes (transcription_id, op) VALUES (new.id, 'update');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcriptions_log_delete AFTER DELETE ON transcriptions BEGIN
+            INSERT INTO transcription_changes (transcription_id, op) VALUES (old.id, 'delete');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS transcription_changes_prune AFTER INSERT ON transcription_changes
+        WHEN new.version % 1000 = 0 BEGIN
+            DELETE FROM transcription_changes WHERE version <= new.version - 100000;
+        END
+        ''',
+    ),
+    # 8: hash of the original upload, kept in the audio store (see
+    # audio_store.py)
+    (
+        'ALTER TABLE transcriptions ADD COLUMN upload_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_transcriptions_upload_hash ON transcriptions (upload_hash)',
+    ),
+    # 9: imported files whose transcription was moved to the archive, so the
+    # importer doesn't import them again (see archive.py)
+    (
+        'ALTER TABLE import_progress ADD COLUMN archived INTEGER NOT NULL DEFAULT 0',
+    ),
+]
+
+
+# Initialize the database, create tables if they don't exist and bring the
+# schema up to date
+def init_db():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transcription TEXT NOT NULL,
+                translated_text TEXT,
+                translation_direction TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
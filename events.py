@@ -0,0 +1,102 @@
+import json
+import queue
+import threading
+
+
+class TooManySubscribers(Exception):
+    """Raised when the hub already has max_subscribers subscribers."""
+
+
+# In-process publish/subscribe hub. Each subscriber gets its own bounded
+# queue; when a slow subscriber's queue is full the oldest event is dropped so
+# publishers never block. Every subscriber is an open event stream, which
+# holds a server thread for as long as it lasts, so their number is capped
+# at max_subscribers (0 for no cap).
+class Subscription:
+    def __init__(self, topic, maxsize):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # Next (event, data) pair, or None if nothing arrived within timeout
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    def __init__(self, queue_size=256, max_subscribers=0):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        subscription = Subscription(topic, self.queue_size)
+        with self._lock:
+            if self.max_subscribers and self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._count += 1
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None and subscription in subscribers:
+                self._count -= 1
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._subscribers.get(topic, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, topic, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put((event, data))
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Generate a Server-Sent Events stream for a subscription. A comment line is
+# sent every keepalive seconds so proxies keep the connection open; the stream
+# ends after an event named in last_events. The subscription is dropped when
+# the client goes away.
+def sse_stream(hub, subscription, keepalive=15, initial=(), last_events=()):
+    try:
+        for event, data in initial:
+            yield format_sse(event, data)
+            if event in last_events:
+                return
+        while True:
+            item = subscription.get(timeout=keepalive)
+            if item is None:
+                yield ': keepalive\n\n'
+                continue
+            event, data = item
+            yield format_sse(event, data)
+            if event in last_events:
+                return
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+import zlib
+
+# Export formats for /download_transcriptions: mimetype, file extension, an
+# optional header line and a function rendering one row.
+
+DIRECTION_NAMES = {
+    'en_to_tl': 'English to Tagalog',
+    'tl_to_en': 'Tagalog to English',
+}
+
+CSV_FIELDS = ('id', 'timestamp', 'transcription', 'translated_text', 'translation_direction')
+
+
+def format_txt(row):
+    if row['translated_text'] and row['translation_direction']:
+        direction_text = DIRECTION_NAMES.get(row['translation_direction'], row['translation_direction'])
+        return f"{row['timestamp']} - {row['transcription']} | {direction_text} | {row['translated_text']}\n"
+    return f"{row['timestamp']} - {row['transcription']}\n"
+
+
+def format_csv(row):
+    output = io.StringIO()
+    csv.writer(output).writerow([row[field] for field in CSV_FIELDS])
+    return output.getvalue()
+
+
+def format_jsonl(row):
+    return json.dumps(dict(row), ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'txt': ('text/plain', 'txt', None, format_txt),
+    'csv': ('text/csv', 'csv', ','.join(CSV_FIELDS) + '\r\n', format_csv),
+    'jsonl': ('application/x-ndjson', 'jsonl', None, format_jsonl),
+}
+
+
+# Render rows as encoded chunks of roughly chunk_size bytes, gzip-compressing
+# them on the fly when compress is set
+def stream_export(rows, fmt, compress=False, chunk_size=64 * 1024):
+    _, _, header, format_row = FORMATS[fmt]
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(text):
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    buffer = [header] if header else []
+    size = len(header) if header else 0
+    for row in rows:
+        line = format_row(row)
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = emit(''.join(buffer))
+            buffer, size = [], 0
+            if data:
+                yield data
+    data = emit(''.join(buffer))
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
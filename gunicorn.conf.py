@@ -0,0 +1,56 @@
+import os
+
+# Production server settings: gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Requests spend most of their time waiting on the speech and translation
+# services, so workers handle many requests at once. The default gthread
+# worker gives each process GUNICORN_THREADS threads. With
+# GUNICORN_WORKER_CLASS=gevent (needs the gevent package) network calls
+# yield to other requests instead of blocking a thread, so one process can
+# keep GUNICORN_WORKER_CONNECTIONS upstream calls in flight.
+#
+# Transcription jobs, live transcription sessions and the event hub behind
+# the SSE endpoints live in the memory of the process that created them, so
+# /jobs/<id> and /stream/<id>/... only work on the worker that started them.
+# Hence one worker by default; more than one (WEB_CONCURRENCY) is only safe
+# behind a load balancer that pins each client to one worker.
+#
+# Under gthread every open event stream (one per open page, plus one per live
+# recording) holds a thread for as long as it stays open, so the thread
+# count caps connected browsers as well as concurrent requests. The default
+# 64 threads leave 16 for requests beyond the app's 48 streams
+# (SSE_MAX_SUBSCRIBERS); raise both together. For more than a few dozen
+# browsers use gevent, where a stream costs a greenlet instead of a thread,
+# and raise SSE_MAX_SUBSCRIBERS towards GUNICORN_WORKER_CONNECTIONS.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# Long recordings can take a while to recognize, and live transcription
+# event streams stay open for as long as the user records
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycling a worker drops its queued jobs, their results and any live
+# sessions, so it is off unless GUNICORN_MAX_REQUESTS is set to bound memory
+# growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# Each worker builds its own thread pools and SQLite connections after the
+# fork, so the app must not be preloaded in the master
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.shutdown()
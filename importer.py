@@ -0,0 +1,167 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import db
+from audio import UnsupportedAudioError, normalize_audio
+from recognition import hash_audio, hash_upload, recognize_audio, shift_segments
+
+# Offline bulk import: transcribe a directory tree or a manifest of audio
+# files on a process pool and backfill the transcriptions table. Progress is
+# checkpointed in the import_progress table in the same transaction as the
+# rows it describes, so an interrupted import resumes where it stopped and
+# skips files that haven't changed since they were imported. With an audio
+# store, imported files are copied into it so they can be played back and
+# re-transcribed like uploads.
+
+AUDIO_EXTENSIONS = ('.wav', '.aif', '.aiff', '.flac', '.ogg', '.oga', '.opus', '.webm', '.mp3', '.m4a', '.mp4')
+
+SELECT_IMPORTED = 'SELECT path, size, mtime FROM import_progress WHERE transcription_id IS NOT NULL OR archived'
+UPSERT_IMPORT_PROGRESS = '''
+    INSERT INTO import_progress (path, size, mtime, transcription_id, error, imported_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (path) DO UPDATE
+    SET size = excluded.size, mtime = excluded.mtime, transcription_id = excluded.transcription_id,
+        error = excluded.error, imported_at = excluded.imported_at
+'''
+
+
+# Audio files below root, in a stable order
+def walk_audio_files(root):
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                yield os.path.join(directory, name)
+
+
+# Paths listed one per line in a manifest; relative paths are resolved
+# against the manifest's directory and lines starting with # are skipped
+def read_manifest(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield os.path.join(base, line)
+
+
+# Transcribe one file; runs in a process pool worker. Never raises, so one
+# bad file doesn't stop the import.
+def transcribe_file(path, backend, options):
+    result = {'path': path, 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            result['upload_hash'] = hash_upload(f)
+            audio, offset_ms = normalize_audio(f, **options.get('ingest', {}))
+        result['audio_hash'] = hash_audio(audio)
+        result.update(shift_segments(recognize_audio(audio, backend, None, options), offset_ms))
+    except (OSError, UnsupportedAudioError) as e:
+        result['error'] = str(e)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+class Importer:
+    def __init__(self, backend, options, workers=None, batch_size=500, report_interval=5.0, echo=print,
+                 store=None):
+        self.backend = backend
+        self.store = store
+        self.options = options
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.echo = echo
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self._pending = []
+        self._started = self._last_report = 0.0
+
+    def run(self, paths):
+        self._started = self._last_report = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = {}
+            for path, stat in self._unimported(paths):
+                # Keep a bounded window of files in flight so huge archives
+                # aren't all queued (and read) up front
+                if len(in_flight) >= self.workers * 2:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(finished, in_flight)
+                in_flight[executor.submit(transcribe_file, path, self.backend, self.options)] = stat
+            while in_flight:
+                finished, _ = wait(in_flight, timeout=self.report_interval, return_when=FIRST_COMPLETED)
+                self._collect(finished, in_flight)
+        self._flush()
+        self._report()
+        return {'done': self.done, 'failed': self.failed, 'skipped': self.skipped,
+                'seconds': time.monotonic() - self._started}
+
+    # (path, stat) of the files that aren't already imported with the same
+    # size and mtime
+    def _unimported(self, paths):
+        imported = {row['path']: (row['size'], row['mtime']) for row in db.query(SELECT_IMPORTED)}
+        for path in dict.fromkeys(os.path.abspath(path) for path in paths):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                self._pending.append(({'path': path, 'error': str(e)}, None))
+                continue
+            if imported.get(path) == (stat.st_size, stat.st_mtime):
+                self.skipped += 1
+                continue
+            yield path, stat
+
+    def _collect(self, finished, in_flight):
+        for future in finished:
+            self._pending.append((future.result(), in_flight.pop(future)))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        if time.monotonic() - self._last_report >= self.report_interval:
+            self._report()
+
+    # Write a batch of results and their checkpoints in one transaction.
+    # Failed files get a checkpoint with the error and are retried next run.
+    def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        now = time.time()
+        if self.store is not None:
+            # Copied before the transaction so the write lock isn't held
+            # while files are copied
+            for result, _ in batch:
+                if result['error'] is None:
+                    try:
+                        self.store.put_path(result['path'], result['upload_hash'])
+                    except OSError as e:
+                        result['error'] = str(e)
+                    else:
+                        result['stored_hash'] = result['upload_hash']
+        with db.transaction() as conn:
+            for result, stat in batch:
+                size, mtime = (stat.st_size, stat.st_mtime) if stat else (None, None)
+                if result['error'] is None and result.pop('failed'):
+                    result['error'] = result['transcription']
+                if result['error'] is not None:
+                    self.failed += 1
+                    conn.execute(UPSERT_IMPORT_PROGRESS, (result['path'], size, mtime, None, result['error'], now))
+                    continue
+                transcription_id = conn.execute(
+                    db.INSERT_TRANSCRIPTION,
+                    (result['transcription'], result['audio_hash'], result.get('stored_hash'))).lastrowid
+                conn.executemany(db.INSERT_SEGMENT, [
+                    (transcription_id, segment['index'], segment['start_ms'], segment['end_ms'], segment['text'])
+                    for segment in result['segments']
+                ])
+                conn.execute(UPSERT_IMPORT_PROGRESS, (result['path'], size, mtime, transcription_id, None, now))
+                self.done += 1
+
+    def _report(self):
+        self._last_report = time.monotonic()
+        elapsed = self._last_report - self._started
+        processed = self.done + self.failed + len(self._pending)
+        rate = processed / elapsed if elapsed else 0.0
+        self.echo(f'{processed} files processed ({self.failed} failed, {self.skipped} skipped) '
+                  f'in {elapsed:.1f}s, {rate:.2f} files/s')
@@ -0,0 +1,131 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when every worker is busy and the pending queue is full."""
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.future = None
+        self.finished = threading.Event()
+
+    def to_dict(self):
+        status = self.status
+        # Process pools don't report back when they pick a job up, so ask the future
+        if status == 'queued' and self.future is not None and self.future.running():
+            status = 'running'
+        data = {'id': self.id, 'status': status}
+        if self.result is not None:
+            data['result'] = self.result
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+# Bounded job queue backed by a thread or process pool.
+#
+# Work functions run on the pool; the optional on_complete callback runs back
+# in this process (so it can touch the database) and its return value becomes
+# the job result. submit() raises QueueFull instead of blocking so callers can
+# shed load.
+class JobQueue:
+    def __init__(self, app=None):
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = None
+        self.executor_kind = 'thread'
+        self.workers = 4
+        self.queue_size = 32
+        self.history_size = 1000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.executor_kind = app.config['JOB_EXECUTOR']
+        self.workers = app.config['JOB_WORKERS']
+        self.queue_size = app.config['JOB_QUEUE_SIZE']
+        self.history_size = app.config['JOB_HISTORY_SIZE']
+        if self.executor_kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown JOB_EXECUTOR: {self.executor_kind!r}")
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions['job_queue'] = self
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='job')
+        return self._executor
+
+    @property
+    def depth(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished.is_set())
+
+    def submit(self, fn, *args, on_complete=None):
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+
+        def done(future):
+            try:
+                result = future.result()
+                job.result = on_complete(result) if on_complete else result
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                self._slots.release()
+                job.finished.set()
+
+        try:
+            job.future = self._get_executor().submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self._slots.release()
+            raise
+        job.future.add_done_callback(done)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Block until the job finishes or the timeout expires; returns the job or None
+    def wait(self, job_id, timeout=None):
+        job = self.get(job_id)
+        if job is not None:
+            job.finished.wait(timeout)
+        return job
+
+    # Forget the oldest finished jobs once the history is full
+    def _evict(self):
+        excess = len(self._jobs) - self.history_size
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.finished.is_set()][:excess]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,151 @@
+import datetime
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no file locks (Windows): every process runs the task
+    fcntl = None
+
+import db
+from archive import Archive
+from metrics import registry
+
+archived_rows = registry.counter('archived_rows_total', 'Transcriptions moved to the archive.')
+expired_cache_rows = registry.counter('expired_cache_rows_total', 'Expired cache entries deleted.')
+freed_pages = registry.counter('vacuumed_pages_total', 'Free database pages returned to the file system.')
+
+
+# Periodic database upkeep, run on a background thread every interval
+# seconds:
+#   - retention: transcriptions older than retention_days move to the archive
+#     (see archive.py), so the live table and its indexes only hold recent rows
+#   - cache expiry: persistent entries of caches past their TTL, which can
+#     never be hit again, are deleted
+#   - incremental vacuum: up to vacuum_pages free pages, left behind by
+#     deletes, are returned to the file system
+#   - ANALYZE, bounded by analysis_limit, keeps the planner's statistics
+#     current as the table changes
+# on_archive(ids, version) is called for every archived block so callers can
+# announce the deletions.
+#
+# Every server process starts the thread, but only the one holding an
+# exclusive lock on lock_path does the work; the others try again each
+# interval and take over if the holder exits.
+class Maintenance:
+    def __init__(self, app=None, on_archive=None, caches=()):
+        self.on_archive = on_archive
+        self.caches = caches
+        self.retention_days = 0
+        self.interval = 3600
+        self.block_size = 1000
+        self.vacuum_pages = 1000
+        self.analysis_limit = 1000
+        self.archive = Archive()
+        self.lock_path = None
+        self.logger = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.retention_days = app.config['RETENTION_DAYS']
+        self.interval = app.config['MAINTENANCE_INTERVAL']
+        self.block_size = app.config['ARCHIVE_BLOCK_SIZE']
+        self.vacuum_pages = app.config['VACUUM_PAGES']
+        self.analysis_limit = app.config['ANALYSIS_LIMIT']
+        self.archive = Archive(app.config['ARCHIVE_DATABASE'])
+        self.lock_path = app.config['MAINTENANCE_LOCK']
+        self.logger = app.logger
+        app.extensions['maintenance'] = self
+
+    # Start the background thread, unless MAINTENANCE_INTERVAL is 0
+    def start(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # Take the lock that makes this process the one doing maintenance, or
+    # return False when another process holds it
+    def _acquire_lock(self):
+        if fcntl is None or not self.lock_path or self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._acquire_lock():
+                continue
+            try:
+                self.run_once()
+            except Exception:
+                self.logger.exception('Database maintenance failed')
+
+    def run_once(self, retention_days=None):
+        try:
+            archived = self.archive_expired(retention_days)
+            expired = self.purge_caches()
+            vacuumed = self.vacuum()
+            self.analyze()
+            return {'archived': archived, 'expired_cache_rows': expired, 'vacuumed_pages': vacuumed}
+        finally:
+            db.pool.release()
+
+    def archive_expired(self, retention_days=None):
+        days = self.retention_days if retention_days is None else retention_days
+        if not days:
+            return 0
+        # Timestamps are stored in UTC (CURRENT_TIMESTAMP)
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+        moved = self.archive.archive_before(cutoff.strftime('%Y-%m-%d %H:%M:%S'), self.block_size)
+        for ids, version in moved:
+            archived_rows.inc(len(ids))
+            if self.on_archive is not None:
+                self.on_archive(ids, version)
+        return sum(len(ids) for ids, _ in moved)
+
+    def purge_caches(self):
+        expired = sum(cache.purge_expired() for cache in self.caches)
+        expired_cache_rows.inc(expired)
+        return expired
+
+    # Free up to vacuum_pages pages (0 for all of them). Only databases in
+    # incremental auto-vacuum mode can do this; new databases are created in
+    # it and `flask vacuum` converts older ones.
+    def vacuum(self):
+        conn = db.connection()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not before:
+            return 0
+        # The pragma frees one page per step, which executescript runs to
+        # completion
+        conn.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+        freed = before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+        freed_pages.inc(freed)
+        return freed
+
+    def analyze(self):
+        conn = db.connection()
+        conn.execute(f'PRAGMA analysis_limit = {int(self.analysis_limit)}')
+        conn.execute('ANALYZE')
@@ -0,0 +1,262 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+# Minimal Prometheus instrumentation: counters, gauges and histograms with
+# labels, rendered in the text exposition format on /metrics. Metrics live in
+# the process that records them, so work done in process pool workers isn't
+# counted.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for name, labelnames, key, value in self.samples():
+            lines.append(f'{name}{format_labels(labelnames, key)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# A gauge is either set directly or read from a callback at scrape time. A
+# callback returns a number, or a dict of label-value tuples to numbers.
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        value = self.function()
+        values = value if isinstance(value, dict) else {(): value}
+        return [(self.name, self.labelnames, key, value) for key, value in sorted(values.items())]
+
+
+# A counter read from a callback at scrape time, for components that already
+# keep their own totals (e.g. cache hit counts)
+class CounterFunction(Gauge):
+    type = 'counter'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        labelnames = self.labelnames + ('le',)
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f'{self.name}_bucket', labelnames, key + (format_value(bound),), count))
+            samples.append((f'{self.name}_sum', self.labelnames, key, total))
+            samples.append((f'{self.name}_count', self.labelnames, key, counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def counter_function(self, name, documentation, function, labelnames=()):
+        return self.register(CounterFunction(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ('method', 'endpoint', 'status'))
+stage_duration = registry.histogram(
+    'stage_duration_seconds', 'Time spent in each processing stage.', ('stage',))
+external_request_duration = registry.histogram(
+    'external_request_duration_seconds', 'Latency of calls to recognition and translation services.',
+    ('service', 'backend'))
+external_request_errors = registry.counter(
+    'external_request_errors_total', 'Failed calls to recognition and translation services.',
+    ('service', 'backend', 'error'))
+
+
+# Time spent in the stages open on this thread, innermost last, less the time
+# already counted by stages nested inside them
+_open_stages = threading.local()
+
+
+# Time a block as a named stage. Stages are recorded in stage_duration and,
+# inside a request, added up per name for the Server-Timing header. Time
+# spent in a stage nested inside another (a db write inside a cache lookup)
+# only counts for the inner one, so stages never add up to more than the
+# request took.
+@contextmanager
+def stage(name):
+    stack = _open_stages.__dict__.setdefault('stack', [])
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        own = elapsed - stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        stage_duration.observe(own, stage=name)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[name] = timings.get(name, 0.0) + own
+
+
+# Time a call to an external service and count its failures by exception
+# type. Exceptions in expected are answers rather than failures (such as
+# speech that could not be understood) and are not counted.
+@contextmanager
+def external_call(service, backend, expected=()):
+    started = time.perf_counter()
+    try:
+        yield
+    except expected:
+        raise
+    except Exception as e:
+        external_request_errors.inc(service=service, backend=backend, error=type(e).__name__)
+        raise
+    finally:
+        external_request_duration.observe(time.perf_counter() - started, service=service, backend=backend)
+
+
+def server_timing(timings, total):
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+# Times every request by endpoint and serves the registry on /metrics. With
+# SERVER_TIMING on, responses carry a Server-Timing header with the stage
+# breakdown, which browser devtools show in the network panel.
+class Metrics:
+    def __init__(self, app=None):
+        self.registry = registry
+        self.server_timing = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.server_timing = app.config['SERVER_TIMING']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        app.extensions['metrics'] = self
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        http_request_duration.observe(elapsed, method=request.method, endpoint=request.endpoint or 'unknown',
+                                      status=response.status_code)
+        if self.server_timing:
+            response.headers['Server-Timing'] = server_timing(g.get('stage_timings', {}), elapsed)
+        return response
+
+    def render(self):
+        return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
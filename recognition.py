@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+
+import speech_recognition as sr
+
+from audio import SAMPLE_WIDTH, normalize_audio, split_on_silence
+from cache import TwoTierCache
+from metrics import external_call
+from recognizers import recognize_segments
+
+UNKNOWN_VALUE_TEXT = "Sorry, could not understand the audio."
+REQUEST_ERROR_TEXT = "Could not request results from the speech recognition service."
+
+SELECT_CACHED_RECOGNITION = '''
+    SELECT transcription, segments, audio_hash FROM recognition_cache
+    WHERE content_hash = ? AND engine = ? AND created_at > ?
+'''
+UPSERT_CACHED_RECOGNITION = '''
+    INSERT INTO recognition_cache (content_hash, engine, transcription, segments, audio_hash, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (content_hash, engine) DO UPDATE
+    SET transcription = excluded.transcription, segments = excluded.segments,
+        audio_hash = excluded.audio_hash, created_at = excluded.created_at
+'''
+DELETE_EXPIRED_RECOGNITIONS = 'DELETE FROM recognition_cache WHERE created_at <= ?'
+
+
+# Audio ingest and segmentation settings passed to recognize_audio
+def recognition_options(config):
+    return {
+        'long_audio_ms': config['LONG_AUDIO_MS'],
+        'ingest': {
+            'sample_rate': config['AUDIO_SAMPLE_RATE'],
+            'trim': config['AUDIO_TRIM_SILENCE'],
+            'trim_threshold': config['SEGMENT_SILENCE_THRESHOLD'],
+        },
+        'segment': {
+            'threshold': config['SEGMENT_SILENCE_THRESHOLD'],
+            'min_silence_ms': config['SEGMENT_MIN_SILENCE_MS'],
+            'max_segment_ms': config['SEGMENT_MAX_MS'],
+        },
+    }
+
+
+# SHA-256 of an uploaded file, read in chunks so it never has to be in memory
+# at once. The file is left rewound for decoding.
+def hash_upload(file, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# SHA-256 of normalized audio, so the same recording uploaded in another
+# container or with different silence around it still matches
+def hash_audio(audio):
+    digest = hashlib.sha256(f'{audio.sample_rate}:{audio.sample_width}:'.encode())
+    digest.update(audio.frame_data)
+    return digest.hexdigest()
+
+
+# Identify the engine and settings a result was produced with; cached
+# results are only reused for the same combination
+def engine_key(backend, options):
+    params = {key: value for key, value in vars(backend).items() if not key.startswith('_') and key != 'api_key'}
+    payload = json.dumps([backend.name, params, options], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+# Run speech recognition over normalized audio (see audio.normalize_audio).
+# Recordings longer than options['long_audio_ms'] are split on silence and the
+# segments recognized in parallel on executor. Returns the text, the
+# per-segment results (empty when the audio was recognized in one piece) and
+# whether the recognition service failed.
+def recognize_audio(audio, backend, executor=None, options=None):
+    options = options or {}
+    pcm = audio.get_raw_data()
+    if not pcm:
+        return {'transcription': UNKNOWN_VALUE_TEXT, 'segments': [], 'failed': False}
+
+    duration_ms = len(pcm) * 1000 // (SAMPLE_WIDTH * audio.sample_rate)
+    long_audio_ms = options.get('long_audio_ms')
+    if long_audio_ms and duration_ms > long_audio_ms:
+        segments = split_on_silence(pcm, audio.sample_rate, **options.get('segment', {}))
+        segments = recognize_segments(backend, segments, executor)
+        failed = any('error' in segment for segment in segments)
+        transcription = ' '.join(segment['text'] for segment in segments if segment['text'])
+        if not transcription:
+            transcription = REQUEST_ERROR_TEXT if failed else UNKNOWN_VALUE_TEXT
+        segments = [{k: v for k, v in segment.items() if k != 'error'} for segment in segments]
+        return {'transcription': transcription, 'segments': segments, 'failed': failed}
+
+    try:
+        with external_call('recognizer', backend.name, expected=sr.UnknownValueError):
+            transcription = backend.recognize(audio)
+        return {'transcription': transcription, 'segments': [], 'failed': False}
+    except sr.UnknownValueError:
+        return {'transcription': UNKNOWN_VALUE_TEXT, 'segments': [], 'failed': False}
+    except sr.RequestError:
+        return {'transcription': REQUEST_ERROR_TEXT, 'segments': [], 'failed': True}
+
+
+# Segment timings come out relative to the normalized audio, which starts
+# where leading silence was trimmed off; move them onto the timeline of the
+# original recording, offset_ms later
+def shift_segments(result, offset_ms):
+    if not offset_ms:
+        return result
+    return dict(result, segments=[
+        dict(segment, start_ms=segment['start_ms'] + offset_ms, end_ms=segment['end_ms'] + offset_ms)
+        for segment in result['segments']
+    ])
+
+
+# Decode and recognize an uploaded file stored at path, for queued jobs, so
+# decoding runs on the job's worker instead of the request thread. The file
+# is deleted once read when remove is set. Returns recognize_audio's result
+# with the hash of the normalized audio and its offset_ms added.
+def recognize_upload(path, backend, executor=None, options=None, max_seconds=None, remove=False):
+    options = options or {}
+    try:
+        with open(path, 'rb') as f:
+            audio, offset_ms = normalize_audio(f, **options.get('ingest', {}), max_seconds=max_seconds)
+    finally:
+        if remove:
+            os.unlink(path)
+    result = recognize_audio(audio, backend, executor, options)
+    result['audio_hash'] = hash_audio(audio)
+    result['offset_ms'] = offset_ms
+    return result
+
+
+# Content-addressed cache of recognition results keyed by (content hash,
+# engine), see TwoTierCache. Results are stored under both the hash of the
+# raw upload, so an identical re-upload is answered before it is even decoded,
+# and the hash of the normalized audio. Copies of a recording can have
+# different silence trimmed off, so segment timings are stored relative to
+# the normalized audio under its hash and on the upload's own timeline under
+# the upload's hash.
+class RecognitionCache(TwoTierCache):
+    name = 'recognition_cache'
+    select_sql = SELECT_CACHED_RECOGNITION
+    upsert_sql = UPSERT_CACHED_RECOGNITION
+    purge_sql = DELETE_EXPIRED_RECOGNITIONS
+
+    def from_row(self, row):
+        return {
+            'transcription': row['transcription'],
+            'segments': json.loads(row['segments']),
+            'audio_hash': row['audio_hash'],
+        }
+
+    def to_row(self, key, result, created_at):
+        return (*key, result['transcription'], json.dumps(result['segments']), result['audio_hash'], created_at)
+
+    def get(self, content_hash, engine):
+        return self.lookup((content_hash, engine))
+
+    def put(self, content_hashes, engine, result):
+        self.store(((content_hash, engine), result) for content_hash in dict.fromkeys(content_hashes))
+
+    # Store a fresh result (timed against the normalized audio) under both
+    # hashes, in one transaction
+    def put_recognized(self, upload_hash, engine, result, offset_ms):
+        self.store((((result['audio_hash'], engine), result),
+                    ((upload_hash, engine), shift_segments(result, offset_ms))))
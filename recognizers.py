@@ -0,0 +1,152 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+from metrics import external_call
+
+# Registry of speech recognition backends, keyed by the name used in
+# RECOGNIZER_BACKEND. Backends are plain picklable objects so they can be
+# shipped to a process pool along with the audio.
+BACKENDS = {}
+
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+class RecognizerBackend:
+    name = None
+
+    def __init__(self, language='en-US'):
+        self.language = language
+
+    # Return the recognized text for an sr.AudioData. Implementations raise
+    # sr.UnknownValueError / sr.RequestError like speech_recognition does.
+    def recognize(self, audio):
+        raise NotImplementedError
+
+
+@register_backend('google')
+class GoogleBackend(RecognizerBackend):
+    def __init__(self, language='en-US', api_key=None):
+        super().__init__(language)
+        self.api_key = api_key
+
+    def recognize(self, audio):
+        return sr.Recognizer().recognize_google(audio, key=self.api_key, language=self.language)
+
+
+# Offline engine; needs the pocketsphinx package
+@register_backend('sphinx')
+class SphinxBackend(RecognizerBackend):
+    def recognize(self, audio):
+        return sr.Recognizer().recognize_sphinx(audio, language=self.language)
+
+
+# Offline engine; needs the vosk package and an unpacked model directory
+@register_backend('vosk')
+class VoskBackend(RecognizerBackend):
+    SAMPLE_RATE = 16000
+
+    def __init__(self, language='en-US', model_path='model'):
+        super().__init__(language)
+        self.model_path = model_path
+        self._model = None
+
+    # Loading a model takes seconds, so keep one per process and never pickle it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_model'] = None
+        return state
+
+    def _get_model(self):
+        if self._model is None:
+            try:
+                from vosk import Model
+            except ImportError:
+                raise sr.RequestError("The vosk backend requires the 'vosk' package.")
+            self._model = Model(self.model_path)
+        return self._model
+
+    def recognize(self, audio):
+        # Loads the model first, which reports a missing vosk package
+        model = self._get_model()
+        from vosk import KaldiRecognizer
+
+        recognizer = KaldiRecognizer(model, self.SAMPLE_RATE)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+# Deterministic local backend for load tests: sleeps for a fixed latency and
+# returns the configured text, or a label derived from the audio content.
+@register_backend('stub')
+class StubBackend(RecognizerBackend):
+    def __init__(self, language='en-US', latency=0.0, text=None):
+        super().__init__(language)
+        self.latency = latency
+        self.text = text
+
+    def recognize(self, audio):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.text:
+            return self.text
+        digest = hashlib.sha1(audio.frame_data).hexdigest()[:8]
+        return f"stub transcription {digest}"
+
+
+def create_backend(name, **options):
+    try:
+        cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown recognizer backend: {name!r}")
+    return cls(**options)
+
+
+# Build the backend selected by the application config
+def backend_from_config(config):
+    name = config['RECOGNIZER_BACKEND']
+    options = {'language': config['RECOGNIZER_LANGUAGE']}
+    if name == 'google':
+        options['api_key'] = config['GOOGLE_SPEECH_API_KEY']
+    elif name == 'vosk':
+        options['model_path'] = config['VOSK_MODEL_PATH']
+    elif name == 'stub':
+        options['latency'] = config['STUB_RECOGNIZER_LATENCY']
+        options['text'] = config['STUB_RECOGNIZER_TEXT']
+    return create_backend(name, **options)
+
+
+# Recognize one audio.Segment; returns its timing, text and any service error
+def recognize_segment(backend, segment):
+    result = {'index': segment.index, 'start_ms': segment.start_ms, 'end_ms': segment.end_ms, 'text': ''}
+    audio = sr.AudioData(segment.pcm, segment.sample_rate, segment.samples.itemsize)
+    try:
+        with external_call('recognizer', backend.name, expected=sr.UnknownValueError):
+            result['text'] = backend.recognize(audio)
+    except sr.UnknownValueError:
+        pass
+    except sr.RequestError as e:
+        result['error'] = str(e)
+    return result
+
+
+# Recognize segments concurrently, returning results in segment order. Without
+# an executor (e.g. inside a process pool worker) a temporary one is used.
+def recognize_segments(backend, segments, executor=None, workers=4):
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as local_executor:
+            return recognize_segments(backend, segments, local_executor)
+    futures = [executor.submit(recognize_segment, backend, segment) for segment in segments]
+    return [future.result() for future in futures]
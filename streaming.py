@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+
+from audio import SilenceSegmenter
+from jobs import QueueFull
+from recognizers import recognize_segment
+
+
+class StreamFinished(Exception):
+    """Raised when audio or a second finish arrives for a finished stream."""
+
+
+class StreamSession:
+    def __init__(self, session_id, segmenter):
+        self.id = session_id
+        self.segmenter = segmenter
+        self.results = {}
+        self.futures = []
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.finished = False
+
+    @property
+    def topic(self):
+        return f'stream:{self.id}'
+
+    # Recognized segments so far, in order
+    def partials(self):
+        with self.lock:
+            return [self.results[index] for index in sorted(self.results)]
+
+    def text(self):
+        return ' '.join(partial['text'] for partial in self.partials() if partial['text'])
+
+
+# Live transcription sessions. The browser posts raw 16-bit mono PCM while it
+# records; each chunk is run through a SilenceSegmenter and every completed
+# segment is recognized on the shared recognition pool. Partial results are
+# published on the session's event hub topic as they come back, so perceived
+# latency is about one segment rather than the whole recording.
+class StreamManager:
+    def __init__(self, hub, executor, backend, app=None):
+        self.hub = hub
+        self.executor = executor
+        self.backend = backend
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self.segmenter_options = {}
+        self.session_ttl = 300
+        self.max_sessions = 100
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.segmenter_options = {
+            'threshold': app.config['SEGMENT_SILENCE_THRESHOLD'],
+            'min_silence_ms': app.config['SEGMENT_MIN_SILENCE_MS'],
+            'max_segment_ms': app.config['SEGMENT_MAX_MS'],
+        }
+        self.session_ttl = app.config['STREAM_SESSION_TTL']
+        self.max_sessions = app.config['STREAM_MAX_SESSIONS']
+        app.extensions['stream_manager'] = self
+
+    def start(self, sample_rate):
+        with self._lock:
+            self._expire()
+            if len(self.sessions) >= self.max_sessions:
+                raise QueueFull()
+            session = StreamSession(uuid.uuid4().hex, SilenceSegmenter(sample_rate, **self.segmenter_options))
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_seen = time.monotonic()
+        return session
+
+    def feed(self, session, pcm):
+        with session.lock:
+            if session.finished:
+                raise StreamFinished()
+            segments = session.segmenter.feed(pcm)
+            self._submit(session, segments)
+
+    # Recognize what is left, wait for every segment and return the full text.
+    # Only the first call finishes the session; later ones raise
+    # StreamFinished, so the recording is saved once.
+    def finish(self, session, timeout=None):
+        with session.lock:
+            if session.finished:
+                raise StreamFinished()
+            session.finished = True
+            self._submit(session, session.segmenter.flush())
+            futures = list(session.futures)
+        wait(futures, timeout)
+        with self._lock:
+            self.sessions.pop(session.id, None)
+        return session.text()
+
+    def _submit(self, session, segments):
+        for segment in segments:
+            session.futures.append(self.executor.submit(self._recognize, session, segment))
+
+    def _recognize(self, session, segment):
+        partial = recognize_segment(self.backend, segment)
+        if 'error' in partial:
+            self.hub.publish(session.topic, 'error', {'index': segment.index, 'error': partial.pop('error')})
+        with session.lock:
+            session.results[segment.index] = partial
+        self.hub.publish(session.topic, 'partial', partial)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.session_ttl
+        for session_id in [s.id for s in self.sessions.values() if s.last_seen < cutoff]:
+            del self.sessions[session_id]
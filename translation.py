@@ -0,0 +1,73 @@
+import unicodedata
+
+from cache import TwoTierCache
+
+# Translation directions accepted by the API, as (src, dest) language codes
+DIRECTIONS = {
+    'en_to_tl': ('en', 'tl'),
+    'tl_to_en': ('tl', 'en'),
+}
+
+SELECT_CACHED_TRANSLATION = '''
+    SELECT translated_text FROM translation_cache
+    WHERE src = ? AND dest = ? AND text = ? AND created_at > ?
+'''
+UPSERT_CACHED_TRANSLATION = '''
+    INSERT INTO translation_cache (src, dest, text, translated_text, created_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (src, dest, text) DO UPDATE
+    SET translated_text = excluded.translated_text, created_at = excluded.created_at
+'''
+DELETE_EXPIRED_TRANSLATIONS = 'DELETE FROM translation_cache WHERE created_at <= ?'
+
+
+# Collapse whitespace and unify the Unicode form so trivially different
+# copies of a phrase share one cache entry
+def normalize_text(text):
+    return unicodedata.normalize('NFC', ' '.join(text.split()))
+
+
+# Translation cache keyed by (src, dest, normalized text), see TwoTierCache
+class TranslationCache(TwoTierCache):
+    name = 'translation_cache'
+    select_sql = SELECT_CACHED_TRANSLATION
+    upsert_sql = UPSERT_CACHED_TRANSLATION
+    purge_sql = DELETE_EXPIRED_TRANSLATIONS
+
+    def from_row(self, row):
+        return row['translated_text']
+
+    def to_row(self, key, translated, created_at):
+        return (*key, translated, created_at)
+
+    def get(self, text, src, dest):
+        return self.lookup((src, dest, normalize_text(text)))
+
+    def put(self, text, src, dest, translated):
+        self.put_many({text: translated}, src, dest)
+
+    # Store several translations for one direction in a single transaction
+    def put_many(self, translations, src, dest):
+        self.store(((src, dest, normalize_text(text)), translated) for text, translated in translations.items())
+
+
+# Translate many texts in one direction. Duplicates (after normalization) are
+# translated once, cached translations are reused and the rest are sent to the
+# translator pool in chunks. Returns a dict mapping each normalized text to
+# its translation.
+def translate_batch(translator, cache, texts, src, dest, chunk_size=50):
+    results = {}
+    pending = []
+    for text in dict.fromkeys(normalize_text(text) for text in texts):
+        translated = cache.get(text, src, dest)
+        if translated is None:
+            pending.append(text)
+        else:
+            results[text] = translated
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        chunk_results = dict(zip(chunk, translator.translate_many(chunk, src, dest)))
+        cache.put_many(chunk_results, src, dest)
+        results.update(chunk_results)
+    return results
@@ -0,0 +1,250 @@
+import queue
+import random
+import threading
+import time
+
+from metrics import external_call
+
+# Registry of translation backends, keyed by the name used in
+# TRANSLATOR_BACKEND. A backend translates a list of texts in one direction
+# and returns the translated strings in the same order.
+TRANSLATOR_BACKENDS = {}
+
+
+def register_translator(name):
+    def decorator(cls):
+        cls.name = name
+        TRANSLATOR_BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+class TranslationError(Exception):
+    """Raised when a translation could not be obtained."""
+
+
+class CircuitOpenError(TranslationError):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+
+class RateLimitedError(TranslationError):
+    """Raised when no request slot frees up in time."""
+
+
+class TranslatorBackend:
+    name = None
+
+    def translate(self, texts, src, dest):
+        raise NotImplementedError
+
+
+# Google Translate through googletrans. Each instance owns one long-lived
+# HTTP client, so pooled instances keep their connections alive.
+@register_translator('google')
+class GoogleTranslateBackend(TranslatorBackend):
+    def __init__(self, timeout=10.0):
+        from googletrans import Translator
+
+        self.translator = Translator(timeout=timeout)
+
+    def translate(self, texts, src, dest):
+        return [result.text for result in self.translator.translate(list(texts), src=src, dest=dest)]
+
+
+# Local backend for tests and load tests: tags the text with the direction
+# after an optional delay, and fails a configurable fraction of calls
+@register_translator('fake')
+class FakeTranslateBackend(TranslatorBackend):
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def translate(self, texts, src, dest):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TranslationError('Simulated translation failure.')
+        return [f'[{src}->{dest}] {text}' for text in texts]
+
+
+# Token bucket allowing `rate` calls per second with bursts of `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take a token, waiting up to timeout seconds; returns False on timeout
+    def acquire(self, timeout=None):
+        if not self.rate:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+# Opens after `threshold` consecutive failures and rejects calls for
+# `reset_timeout` seconds; then lets a single trial call through (half-open)
+# and closes again if it succeeds.
+class CircuitBreaker:
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == 'open' or (state == 'half-open' and self._trial_running):
+                raise CircuitOpenError('Translation service is unavailable. Please try again later.')
+            if state == 'half-open':
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    # The admitted call never reached the service (rate limited, no free
+    # client): let the next call run the half-open trial instead
+    def cancel_call(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+# Pool of long-lived translator clients shared by all requests. Concurrency is
+# capped by the pool size, call rate by a token bucket, and failed calls are
+# retried with jittered exponential backoff behind a circuit breaker that
+# fails fast while the upstream service is down.
+class TranslatorPool:
+    def __init__(self, app=None):
+        self.backend_name = None
+        self._factory = None
+        self._clients = self._empty_slots(4)
+        self.breaker = CircuitBreaker()
+        self.bucket = TokenBucket(0, 1)
+        self.max_retries = 2
+        self.retry_backoff = 0.5
+        self.acquire_timeout = 10.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        name = config['TRANSLATOR_BACKEND']
+        if name == 'google':
+            options = {'timeout': config['TRANSLATOR_TIMEOUT']}
+        elif name == 'fake':
+            options = {'latency': config['FAKE_TRANSLATOR_LATENCY'],
+                       'failure_rate': config['FAKE_TRANSLATOR_FAILURE_RATE']}
+        else:
+            options = {}
+        try:
+            cls = TRANSLATOR_BACKENDS[name]
+        except KeyError:
+            raise ValueError(f"Unknown translator backend: {name!r}")
+
+        self.backend_name = name
+        self._factory = lambda: cls(**options)
+        self._clients = self._empty_slots(config['TRANSLATOR_POOL_SIZE'])
+        self.bucket = TokenBucket(config['TRANSLATOR_RATE_LIMIT'], config['TRANSLATOR_BURST'])
+        self.breaker = CircuitBreaker(config['TRANSLATOR_BREAKER_THRESHOLD'], config['TRANSLATOR_BREAKER_RESET'])
+        self.max_retries = config['TRANSLATOR_MAX_RETRIES']
+        self.retry_backoff = config['TRANSLATOR_RETRY_BACKOFF']
+        self.acquire_timeout = config['TRANSLATOR_TIMEOUT']
+        app.extensions['translator_pool'] = self
+
+    # Clients are created lazily: each slot starts out empty (None) and gets a
+    # client the first time it is checked out. LIFO order keeps reusing the
+    # most recently used, still-connected clients.
+    @staticmethod
+    def _empty_slots(size):
+        slots = queue.LifoQueue()
+        for _ in range(size):
+            slots.put(None)
+        return slots
+
+    def _checkout(self):
+        try:
+            client = self._clients.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise RateLimitedError('All translator clients are busy. Please try again later.')
+        if client is None:
+            try:
+                client = self._factory()
+            except Exception:
+                self._clients.put(None)
+                raise
+        return client
+
+    def translate(self, text, src, dest):
+        return self.translate_many([text], src, dest)[0]
+
+    def translate_many(self, texts, src, dest):
+        for attempt in range(self.max_retries + 1):
+            # Check the breaker first, so an open circuit fails fast without
+            # spending a token or waiting for a client
+            self.breaker.before_call()
+            try:
+                if not self.bucket.acquire(self.acquire_timeout):
+                    raise RateLimitedError('Translation rate limit exceeded. Please try again later.')
+                client = self._checkout()
+            except Exception:
+                self.breaker.cancel_call()
+                raise
+            try:
+                with external_call('translator', self.backend_name):
+                    result = client.translate(texts, src, dest)
+            except Exception as e:
+                self.breaker.record_failure()
+                error = e
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                self._clients.put(client)
+            if attempt < self.max_retries:
+                time.sleep(self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        raise TranslationError(str(error)) from error
+
+    def stats(self):
+        return {
+            'backend': self.backend_name,
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+        }
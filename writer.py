@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+from metrics import registry, stage
+
+group_size = registry.histogram(
+    'write_group_size', 'Writes committed together by the group-commit writer.',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+_STOP = object()
+
+
+# Group-commit writer. Writes are functions taking a connection; submit()
+# queues one and returns a Future for its return value. A single writer
+# thread drains the queue and runs everything that arrives within max_wait
+# seconds of the first write (up to max_group writes) in one transaction, so
+# bursts of small writes share one commit and one fsync and never contend for
+# SQLite's write lock among themselves. Each write runs in its own savepoint:
+# a write that raises is rolled back and fails its own future only.
+class GroupCommitWriter:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_group = 64
+        self.max_wait = 0.002
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['WRITE_BEHIND']
+        self.max_group = app.config['WRITE_GROUP_SIZE']
+        self.max_wait = app.config['WRITE_GROUP_WAIT_MS'] / 1000
+        app.extensions['writer'] = self
+
+    def submit(self, fn):
+        future = Future()
+        if not self.enabled:
+            future.set_running_or_notify_cancel()
+            try:
+                with db.transaction() as conn:
+                    result = fn(conn)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            return future
+        self._ensure_started()
+        self._queue.put((fn, future))
+        return future
+
+    # Submit a write and wait until it is committed; the wait counts towards
+    # the request's db stage
+    def write(self, fn, timeout=None):
+        future = self.submit(fn)
+        with stage('db'):
+            return future.result(timeout)
+
+    # Commit whatever is queued and stop the writer thread
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            group = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(group) < self.max_group:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                group.append(item)
+            self._commit(group)
+            if stop:
+                return
+
+    def _commit(self, group):
+        outcomes = []
+        try:
+            with db.transaction() as conn:
+                for fn, future in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute('SAVEPOINT write')
+                    try:
+                        result = fn(conn)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write')
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    conn.execute('RELEASE write')
+        except Exception as e:
+            # Nothing was committed: fail every write in the group
+            for _, future in group:
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+        group_size.observe(len(outcomes))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)